@@ -0,0 +1,100 @@
+"""Record github API responses to disk and replay them later on.
+
+A recorded run can be re-analysed (different test file heuristics, different
+report) without hitting the network and without spending any rate limit.
+The archives double as realistic test fixtures.
+
+An archive is a directory with a gzipped file with one json line per API
+response (including the pagination link) and a small json file with the
+recorded run's metadata.
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+import gzip
+import json
+import logging
+import os
+import threading
+
+RESPONSES_FILENAME = 'responses.jsonl.gz'
+METADATA_FILENAME = 'run.json'
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveMissError(Exception):
+    """The replayed archive doesn't have the requested response."""
+
+
+def response_key(url, params):
+    """Return string identifying a request to URL with PARAMS."""
+    return json.dumps([url, params or {}], sort_keys=True)
+
+
+class Recorder(object):
+    """Response store that writes every response to an archive."""
+
+    def __init__(self, directory, metadata):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        open(os.path.join(directory, METADATA_FILENAME), 'w').write(
+            json.dumps(metadata, indent=2))
+        self.responses_file = gzip.open(
+            os.path.join(directory, RESPONSES_FILENAME), 'wb')
+        self.num_recorded = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, url, params):
+        # We record, we never serve anything ourselves.
+        return None
+
+    def store(self, url, params, result, next_url):
+        line = json.dumps({'url': url,
+                           'params': params,
+                           'json': result,
+                           'next': next_url},
+                          separators=(',', ':'))
+        with self.lock:
+            self.responses_file.write(line.encode('utf-8') + b'\n')
+            self.num_recorded += 1
+
+    def close(self):
+        self.responses_file.close()
+        logger.info("Recorded %s responses in %s",
+                    self.num_recorded, self.directory)
+
+
+class Replayer(object):
+    """Response store that serves every response from an archive."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.metadata = json.loads(
+            open(os.path.join(directory, METADATA_FILENAME)).read())
+        self.responses = {}
+        responses_file = gzip.open(
+            os.path.join(directory, RESPONSES_FILENAME), 'rb')
+        for line in responses_file:
+            response = json.loads(line.decode('utf-8'))
+            key = response_key(response['url'], response['params'])
+            self.responses[key] = (response['json'], response['next'])
+        responses_file.close()
+        logger.info("Replaying %s responses from %s",
+                    len(self.responses), directory)
+
+    def lookup(self, url, params):
+        key = response_key(url, params)
+        if key not in self.responses:
+            raise ArchiveMissError(
+                "{} (params {!r}) isn't in the archive in {}".format(
+                    url, params, self.directory))
+        return self.responses[key]
+
+    def store(self, url, params, result, next_url):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,152 @@
+"""Size-bounded on-disk cache of github API responses.
+
+Responses are stored gzipped, one file per URL+params. Every endpoint has its
+own time-to-live: a commit's details never change, a list of branches does.
+When the cache grows beyond its disk budget, the least recently used
+responses are evicted.
+
+Files are written to a temporary file first and then renamed, so several
+processes (and their worker threads) can read and fill the same cache
+directory at the same time.
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from githubinfo.archive import response_key
+
+DEFAULT_MAX_SIZE = 500  # In MB.
+FOREVER = None
+# (regex on the URL, time-to-live in seconds). The first match wins.
+CACHE_TTLS = [
+    # Details of a single commit. A SHA is immutable.
+    (re.compile(r'/repos/[^/]+/[^/]+/commits/[0-9a-f]{40}$'), FOREVER),
+    (re.compile(r'/repos/[^/]+/[^/]+/branches'), 5 * 60),
+    (re.compile(r'/repos/[^/]+/[^/]+/commits'), 5 * 60),
+    (re.compile(r'/orgs/[^/]+/repos'), 60 * 60),
+    ]
+DEFAULT_TTL = 5 * 60
+EXTENSION = '.json.gz'
+
+logger = logging.getLogger(__name__)
+
+
+def time_to_live(url):
+    """Return how long (in seconds) a response for URL may be cached."""
+    for regex, ttl in CACHE_TTLS:
+        if regex.search(url):
+            return ttl
+    return DEFAULT_TTL
+
+
+class ResponseCache(object):
+    """Response store that caches responses in DIRECTORY.
+
+    MAX_SIZE is the disk budget in MB.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_size = max_size * 1024 * 1024
+        self.size = sum(size for (filename, size, last_used) in self.entries())
+        # Worker threads store responses concurrently.
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def filename(self, url, params):
+        key = response_key(url, params).encode('utf-8')
+        return os.path.join(self.directory,
+                            hashlib.sha1(key).hexdigest() + EXTENSION)
+
+    def entries(self):
+        """Return (filename, size, last used) for every cached response."""
+        result = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(EXTENSION):
+                continue
+            filename = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                # Evicted by another process in the meantime.
+                continue
+            result.append((filename, stat.st_size, stat.st_mtime))
+        return result
+
+    def lookup(self, url, params):
+        filename = self.filename(url, params)
+        try:
+            cached_file = gzip.open(filename, 'rb')
+            cached = json.loads(cached_file.read().decode('utf-8'))
+            cached_file.close()
+        except (IOError, OSError, ValueError, EOFError):
+            # Not cached, evicted by another process or corrupt.
+            self.misses += 1
+            return None
+        ttl = time_to_live(url)
+        if ttl is not FOREVER and time.time() - cached['stored'] > ttl:
+            self.misses += 1
+            return None
+        try:
+            # The modification time is our "last used" time.
+            os.utime(filename, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return cached['json'], cached['next']
+
+    def store(self, url, params, result, next_url):
+        filename = self.filename(url, params)
+        content = json.dumps({'stored': time.time(),
+                              'json': result,
+                              'next': next_url},
+                             separators=(',', ':'))
+        temp_filename = '{}.{}.{}.tmp'.format(
+            filename, os.getpid(), threading.current_thread().ident)
+        temp_file = gzip.open(temp_filename, 'wb')
+        temp_file.write(content.encode('utf-8'))
+        temp_file.close()
+        size = os.path.getsize(temp_filename)
+        os.rename(temp_filename, filename)
+        with self.lock:
+            self.size += size
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """Remove the least recently used responses until we fit again.
+
+        We go down to 90% of the budget so that we don't have to do this for
+        every next response.
+        """
+        with self.lock:
+            entries = sorted(self.entries(), key=lambda entry: entry[2])
+            self.size = sum(size for (filename, size, last_used) in entries)
+            target = 0.9 * self.max_size
+            num_evicted = 0
+            for filename, size, last_used in entries:
+                if self.size <= target:
+                    break
+                try:
+                    os.remove(filename)
+                except OSError:
+                    # Another process was faster.
+                    pass
+                self.size -= size
+                num_evicted += 1
+        logger.debug("Evicted %s responses from the cache", num_evicted)
+
+    def close(self):
+        logger.debug("Cache hits: %s, misses: %s", self.hits, self.misses)
@@ -5,19 +5,49 @@ from __future__ import absolute_import
 from collections import defaultdict
 # from pprint import pprint
 import argparse  # Note: python 2.7+
+import copy
 import datetime
 import json
 import logging
+import math
 import os
+import random
+import re
 import sys
+import threading
+import time
 
 import requests
 
 from githubinfo import __version__
+from githubinfo import archive
+from githubinfo import cache
+from githubinfo import cube
+from githubinfo import progress
+from githubinfo import sampling
+from githubinfo import scheduling
 
 ORG_REPOS_URL = 'https://api.github.com/orgs/{organization}/repos'
 COMMITS_URL = 'https://api.github.com/repos/{owner}/{project}/commits'
 BRANCHES_URL = 'https://api.github.com/repos/{owner}/{project}/branches'
+RATE_LIMIT_URL = 'https://api.github.com/rate_limit'
+
+DEFAULT_TESTFILE_RULES = {
+    # Glob patterns (with ``*`` and ``?``) on the full path. Exclusion wins.
+    'include': ['*test*'],
+    'exclude': [
+        # This one almost always doesn't have anything to do with
+        # an added test.
+        '*testsettings.py*',
+        ],
+    # Regular expressions, searched for anywhere in the path.
+    'include_regexes': [],
+    'exclude_regexes': [],
+    # Files that are tests if their patch contains the doctest marker.
+    'doctest_extensions': ['.rst', '.txt'],
+    'doctest_marker': '>>>',
+    }
+MAX_MEMOIZED_PATHS = 100000
 
 # Settings are global and can be modified by some setup/init method.
 SETTINGS = {
@@ -37,58 +67,233 @@ SETTINGS = {
         ('rvanlaar', 'djangorecipe'),
         ('zestsoftware', 'zest.releaser'),
         ],
+    'testfile_rules': dict(DEFAULT_TESTFILE_RULES),
     }
 SETTINGS_FILENAME = 'settings.json'
+STATE_FILENAME = 'testcommitinfo-state.jsonl'
+TIMINGS_FILENAME = 'testcommitinfo-timings.json'
+CHECKPOINT_INTERVAL = 25  # Flush the state file every N fetched commits.
+WEBHOOK_PORT = 8765
+
+# Optional layers underneath grab_json_page, like the --record/--replay
+# archives and the --cache. They have a ``lookup(url, params)`` method that
+# returns a ``(json, next_url)`` tuple or None and a ``store(url, params,
+# json, next_url)`` method that is called for every proper response we got
+# from github.
+RESPONSE_STORES = []
+# Counters of the current run. Shown once main() enables them.
+PROGRESS = progress.Progress()
 
 logger = logging.getLogger(__name__)
 
 
+class GithubError(Exception):
+    """Github returned an error (rate limit, server error) instead of data.
+    """
+
+
 def since():
-    """Return iso-formatted string for github from-that-date query."""
+    """Return iso-formatted string for github from-that-date query.
+
+    A resumed run re-uses the date of the original run (stored as
+    ``SETTINGS['since']``) so that both look at the same period.
+    """
+    if SETTINGS.get('since'):
+        return SETTINGS['since']
     now = datetime.datetime.now()
     a_while_ago = now - datetime.timedelta(days=SETTINGS['days'])
     return a_while_ago.isoformat()
 
 
-def grab_json(url, params=None, second_try=False):
-    """Return json from URL, including handling pagination."""
+def period_params():
+    """Return since/until params for github's commit listing.
+
+    ``SETTINGS['until']`` is the start of the run. A resumed run re-uses it,
+    so that the projects it lists don't get commits that were pushed after
+    the original run started. Without it, there's no upper bound.
+    """
+    params = {'since': since()}
+    if SETTINGS.get('until'):
+        params['until'] = SETTINGS['until']
+    return params
+
+
+def api_get(url, params=None):
+    """Return response of a single, authenticated, API request."""
     auth = SETTINGS['auth']
     if isinstance(auth, list):
         auth = tuple(auth)
-    req = requests.get(url, auth=auth, params=params)
+    scheduling.count_request()
+    return requests.get(url, auth=auth, params=params)
+
+
+def time_slices(num_slices):
+    """Return since/until params that split our period in slices.
+
+    The newest slice comes first and ends where the regular, unsliced,
+    query ends (see :func:`period_params`). The borders only depend on the
+    period and the number of days, so a resumed or replayed run gets the
+    same slices.
+    """
+    start = datetime.datetime.strptime(since()[:19], '%Y-%m-%dT%H:%M:%S')
+    step = datetime.timedelta(days=SETTINGS['days']) // num_slices
+    borders = [since()] + [(start + step * index).isoformat()
+                           for index in range(1, num_slices)]
+    result = [dict(period_params(), since=borders[-1])]
+    for index in reversed(range(num_slices - 1)):
+        result.append({'since': borders[index], 'until': borders[index + 1]})
+    return result
+
+
+def grab_json_page(url, params=None, second_try=False):
+    """Return json from URL and the URL of the next page (or None).
+
+    Only one request is done: pagination is up to the caller. Errors that
+    say nothing about the data (bad credentials, rate limit, server errors)
+    raise a GithubError. Only proper (200 OK) responses are passed on to
+    the response stores.
+    """
+    for index, response_store in enumerate(RESPONSE_STORES):
+        response = response_store.lookup(url, params)
+        if response is not None:
+            # The stores in front of this one (a recorder in front of a
+            # cache, for instance) still want to see the response.
+            for earlier_store in RESPONSE_STORES[:index]:
+                earlier_store.store(url, params, *response)
+            PROGRESS.response(cached=True)
+            return response
+    req = api_get(url, params=params)
+    PROGRESS.response(
+        rate_limit_remaining=req.headers.get('X-RateLimit-Remaining'))
     if req.status_code == 401 and not second_try:
         # Unauthorized. Somehow this happens to me in rare cases.
         # Retry it once.
         logger.warn("Got a 401 unauthorized on %s, retrying it", url)
-        return grab_json(url, params=params, second_try=True)
+        return grab_json_page(url, params=params, second_try=True)
+    if req.status_code in (401, 403) or req.status_code >= 500:
+        raise GithubError("Got a {} on {}: {}".format(
+                req.status_code, url, req.text[:200]))
     result = req.json()
     is_expected_type = (isinstance(result, list) or isinstance(result, dict))
     if not is_expected_type and not second_try:
         # Wrong type. String error message, probably.
         # Retry it once.
         logger.warn("Got a wrong type (%r) on %s, retrying it", result, url)
-        return grab_json(url, params=params, second_try=True)
-    if req.links.get('next'):
+        return grab_json_page(url, params=params, second_try=True)
+    next_url = req.links.get('next', {}).get('url')
+    if req.status_code == 200:
+        for response_store in RESPONSE_STORES:
+            response_store.store(url, params, result, next_url)
+    return result, next_url
+
+
+def grab_json(url, params=None):
+    """Return json from URL, including handling pagination."""
+    result, next_url = grab_json_page(url, params=params)
+    if next_url:
+        # Don't extend the first page in-place, it might be a stored one.
+        result = list(result)
+    while next_url:
         # Paginated content, so we want to grab the rest.
-        url = req.links['next']['url']
         # The assumption is "paginated content means it is a list".
-        result += grab_json(url, params=params)
+        page, next_url = grab_json_page(next_url, params=params)
+        result += page
     return result
 
 
+def glob_to_regex(pattern):
+    """Return regex for a glob pattern with ``*`` and ``?`` wildcards."""
+    return '.*'.join('.'.join(re.escape(part) for part in chunk.split('?'))
+                     for chunk in pattern.split('*'))
+
+
+class TestFileClassifier(object):
+    """Decide which changed files are test files, according to the rules.
+
+    The globs and doctest extensions are compiled into one regex, so a path
+    needs only one match for those. The regexes from the settings are
+    compiled and searched for one by one: they may have their own groups,
+    backreferences and flags. The verdict on a path is memoized: the same
+    paths turn up again and again in a project's history. Only for possible
+    doctests the patch has to be looked at.
+    """
+
+    def __init__(self, custom_rules):
+        rules = dict(DEFAULT_TESTFILE_RULES)
+        rules.update(custom_rules)
+        self.doctest_marker = rules['doctest_marker']
+        self.exclude_regexes = [re.compile(regex)
+                                for regex in rules['exclude_regexes']]
+        self.include_regexes = [re.compile(regex)
+                                for regex in rules['include_regexes']]
+        alternatives = []
+        # The first alternative that matches wins, so exclusion goes first.
+        if rules['exclude']:
+            alternatives.append('(?P<exclude>{})'.format('|'.join(
+                        glob_to_regex(glob) for glob in rules['exclude'])))
+        if rules['include']:
+            alternatives.append('(?P<include>{})'.format('|'.join(
+                        glob_to_regex(glob) for glob in rules['include'])))
+        if rules['doctest_extensions']:
+            alternatives.append('(?P<doctest>.*(?:{}))'.format('|'.join(
+                        re.escape(extension)
+                        for extension in rules['doctest_extensions'])))
+        self.matcher = re.compile(
+            r'(?s)(?:{})\Z'.format('|'.join(alternatives) or '(?!)'))
+        self.verdicts = {}
+
+    def path_verdict(self, filepath):
+        """Return True/False, or None if it depends on the file's patch."""
+        try:
+            return self.verdicts[filepath]
+        except KeyError:
+            pass
+        match = self.matcher.match(filepath)
+        group = match and match.lastgroup
+        if group == 'exclude' or any(regex.search(filepath)
+                                     for regex in self.exclude_regexes):
+            verdict = False
+        elif group == 'include' or any(regex.search(filepath)
+                                       for regex in self.include_regexes):
+            verdict = True
+        elif group == 'doctest':
+            verdict = None
+        else:
+            verdict = False
+        if len(self.verdicts) >= MAX_MEMOIZED_PATHS:
+            self.verdicts.clear()
+        self.verdicts[filepath] = verdict
+        return verdict
+
+    def classify(self, fileinfos):
+        """Return list of booleans: which files are test files."""
+        result = []
+        for fileinfo in fileinfos:
+            verdict = self.path_verdict(fileinfo['filename'])
+            if verdict is None:
+                # Possible doctest.
+                verdict = self.doctest_marker in fileinfo.get('patch', '')
+            result.append(verdict)
+        return result
+
+
+_classifier = {'rules': None, 'classifier': None}
+
+
+def testfile_classifier():
+    """Return classifier for the current ``testfile_rules`` setting.
+
+    It is only compiled again when the rules change.
+    """
+    rules = SETTINGS.get('testfile_rules', {})
+    if _classifier['rules'] != rules:
+        _classifier['classifier'] = TestFileClassifier(rules)
+        _classifier['rules'] = copy.deepcopy(rules)
+    return _classifier['classifier']
+
+
 def is_testfile(fileinfo):
-    filepath = fileinfo['filename']
-    if 'testsettings.py' in filepath:
-        # This one almost always doesn't have anything to do with
-        # an added test.
-        return False
-    if 'test' in filepath:
-        return True
-    if filepath.endswith('.rst') or filepath.endswith('.txt'):
-        # Possible doctest.
-        if '>>>' in fileinfo.get('patch', ''):
-            return True
-    return False
+    return testfile_classifier().classify([fileinfo])[0]
 
 
 def load_custom_settings(settings_file=SETTINGS_FILENAME):
@@ -100,18 +305,93 @@ def load_custom_settings(settings_file=SETTINGS_FILENAME):
         SETTINGS.update(custom_settings)
 
 
+def load_profile(filename):
+    """Return our settings, updated with the json found in the profile file.
+
+    A profile is a settings file of one team for a batch run. Its name
+    defaults to the filename without the extension.
+    """
+    profile = copy.deepcopy(SETTINGS)
+    profile['name'] = os.path.splitext(os.path.basename(filename))[0]
+    profile.update(json.loads(open(filename).read()))
+    return profile
+
+
+def union_settings(profiles):
+    """Return the settings that cover all profiles: widest period, all repos.
+    """
+    organizations = []
+    extra_projects = []
+    for profile in profiles:
+        for organization in profile['organizations']:
+            if organization not in organizations:
+                organizations.append(organization)
+        for extra_project in profile['extra_projects']:
+            if tuple(extra_project) not in extra_projects:
+                extra_projects.append(tuple(extra_project))
+    return {'days': max(profile['days'] for profile in profiles),
+            'organizations': organizations,
+            'extra_projects': extra_projects}
+
+
+def profile_since(profile):
+    """Return iso-formatted start of the profile's period.
+
+    The profile's period ends where the batch run's (possibly wider) period
+    ends.
+    """
+    start = datetime.datetime.strptime(since()[:19], '%Y-%m-%dT%H:%M:%S')
+    start += datetime.timedelta(days=SETTINGS['days'] - profile['days'])
+    return start.isoformat()
+
+
 class Commit(object):
     """Wrapper around a commit dict from github's API."""
 
     def __init__(self, the_dict):
-        self.num_testfiles_changed = 0
+        self.testfiles = []
         self.user = the_dict['commit']['committer']['name']
-        commit_url = the_dict['url']
-        commit_info = grab_json(commit_url)
-        for changed_file in commit_info.get('files', []):
-            if is_testfile(changed_file):
-                self.num_testfiles_changed += 1
+        self.date = the_dict['commit']['committer'].get('date', '')
+        self.url = the_dict['url']
+        commit_info = grab_json(self.url)
+        if 'message' in commit_info and 'files' not in commit_info:
+            # An error message, we mustn't count (or checkpoint) it as a
+            # commit without test files.
+            raise GithubError("Expected commit details on {}, got {!r}".format(
+                    self.url, commit_info))
+        changed_files = commit_info.get('files', [])
+        verdicts = testfile_classifier().classify(changed_files)
+        for changed_file, is_test in zip(changed_files, verdicts):
+            if is_test:
+                self.testfiles.append(changed_file['filename'])
                 logger.debug("Test file: {}".format(changed_file['filename']))
+        self.num_testfiles_changed = len(self.testfiles)
+
+    @classmethod
+    def from_facts(cls, facts):
+        """Return commit restored from its :attr:`facts`, without API calls.
+        """
+        commit = cls.__new__(cls)
+        commit.url = facts['url']
+        commit.user = facts['user']
+        commit.date = facts.get('date', '')
+        commit.testfiles = facts.get('testfiles', [])
+        commit.num_testfiles_changed = facts['num_testfiles_changed']
+        return commit
+
+    @property
+    def facts(self):
+        """Return the json-serializable info we need to count the commit."""
+        return {'url': self.url,
+                'user': self.user,
+                'date': self.date,
+                'testfiles': self.testfiles,
+                'num_testfiles_changed': self.num_testfiles_changed}
+
+    @property
+    def sha(self):
+        # The commit's API URL ends with its SHA.
+        return self.url.rsplit('/', 1)[-1]
 
     @property
     def is_testcommit(self):
@@ -119,15 +399,26 @@ class Commit(object):
 
 
 class TestCommitCounter(object):
+    # With sampling, num_testcommits is an estimate and margin is half the
+    # width of its 95% confidence interval.
+    margin = None
 
     def __init__(self):
         self.num_commits = 0
         self.num_testcommits = 0
         self.testfiles_changed = 0
 
-    def __cmp__(self, other):
-        return cmp((-self.num_testcommits, self.num_commits),
-                   (-other.num_testcommits, other.num_commits))
+    @property
+    def is_estimate(self):
+        return self.margin is not None
+
+    @property
+    def sort_key(self):
+        """Most test commits first; on a tie, the best percentage."""
+        return (-self.num_testcommits, self.num_commits)
+
+    def __lt__(self, other):
+        return self.sort_key < other.sort_key
 
     def add_commit(self, commit):
         self.num_commits += 1
@@ -146,36 +437,102 @@ class TestCommitCounter(object):
         if not self.num_testcommits:
             return ''
         result = str(int(100.0 * self.num_testcommits / self.num_commits))
+        if self.is_estimate:
+            return '(~{}%)'.format(result)
         return '({}%)'.format(result)
 
     def print_info(self):
         msg = "{name}: {tested} {percentage}"
+        tested = self.num_testcommits
+        if self.is_estimate:
+            tested = '~{} +/-{}'.format(tested, self.margin)
         print(msg.format(name=self.name,
-                         tested=self.num_testcommits,
+                         tested=tested,
                          percentage=self.percentage))
 
     def as_dict(self):
         percentage = self.percentage.replace('(', '').replace(')', '')  # Sigh.
-        return dict(name=self.name,
-                    num_testcommits=self.num_testcommits,
-                    percentage=percentage)
+        result = dict(name=self.name,
+                      num_testcommits=self.num_testcommits,
+                      percentage=percentage)
+        if self.is_estimate:
+            result['estimated'] = True
+            result['margin'] = self.margin
+        return result
+
+    def set_totals(self, measures):
+        """Set our numbers from the statistics cube's measures (or None)."""
+        measures = measures or {}
+        self.num_commits = measures.get('num_commits', 0)
+        self.num_testcommits = measures.get('num_testcommits', 0)
+        self.testfiles_changed = measures.get('testfiles_changed', 0)
+
+    def set_estimate(self, num_commits, testcommits, testfiles):
+        """Set our numbers from sampling.Estimate objects."""
+        self.num_commits = num_commits
+        self.num_testcommits = testcommits.value
+        self.testfiles_changed = testfiles.value
+        self.margin = None if testcommits.exact else testcommits.margin
 
 
 class Project(TestCommitCounter):
 
     def __init__(self, owner, project, users,
-                 restrict_to_known_users=False):
+                 restrict_to_known_users=False, checkpoint=None,
+                 statistics_cube=None, commit_sink=None, time_slices=1):
         super(Project, self).__init__()
         self.owner = owner
         self.name = project
         self.users = users
         self.restrict_to_known_users = restrict_to_known_users
+        self.checkpoint = checkpoint
+        self.statistics_cube = statistics_cube
+        self.commit_sink = commit_sink
+        self.time_slices = time_slices
+
+    @property
+    def key(self):
+        return '{}/{}'.format(self.owner, self.name)
 
     def load(self):
+        restored_commits = self.restored_commits()
+        if restored_commits is not None:
+            self.add_commits(restored_commits)
+            return
         logger.debug("Loading project {}...".format(self.name))
+        self.load_listing()
+        loaded_commits = self.load_individual_commits()
+        self.done(loaded_commits)
+
+    def restored_commits(self):
+        """Return the commits from the checkpoint if we're already done."""
+        if self.checkpoint is None:
+            return None
+        done = self.checkpoint.project_commits(self)
+        if done is None:
+            return None
+        logger.debug("Restoring project {} from the checkpoint".format(
+                self.name))
+        restored_commits = [Commit.from_facts(facts) for facts in done]
+        PROGRESS.project_done()
+        if self.commit_sink is not None:
+            for the_commit in restored_commits:
+                self.commit_sink.write(self, the_commit)
+        return restored_commits
+
+    def load_listing(self):
         self.branch_SHAs = self.load_branches()
         self.commits = self.load_project_commits()
-        self.load_individual_commits()
+        PROGRESS.listed(len(self.commits))
+
+    def listing_done(self):
+        """Only the listing was needed (sampling): we're done as well."""
+        PROGRESS.project_done()
+
+    def done(self, loaded_commits):
+        if self.checkpoint is not None:
+            self.checkpoint.project_done(self, loaded_commits)
+        PROGRESS.project_done()
 
     def load_branches(self):
         """Return SHAs of commits for branches."""
@@ -187,27 +544,133 @@ class Project(TestCommitCounter):
         return [branch['commit']['sha'] for branch in branches]
 
     def load_project_commits(self):
+        """Return the commits of all branches, walking shared history once.
+
+        Branches share most of their history. We walk them one by one and
+        stop paginating a branch once we reach a commit that we already got
+        from an earlier branch: the rest of its history is mostly known
+        already. Commits older than ``since()`` are filtered out by github.
+        """
+        if self.time_slices > 1:
+            return self.load_sliced_project_commits()
+        return self.walk_branches(period_params())
+
+    def load_sliced_project_commits(self):
+        """Return the commits of all branches, fetched per time slice.
+
+        The slices are fetched in parallel and stitched together again,
+        newest first, without duplicates (a commit right on the border
+        between two slices is returned for both).
+        """
+        slices = time_slices(self.time_slices)
+        results = [None] * len(slices)
+        slice_requests = [0] * len(slices)
+
+        def fetch(index, params):
+            requests_before = scheduling.num_requests()
+            results[index] = self.walk_branches(params)
+            slice_requests[index] = (scheduling.num_requests() -
+                                     requests_before)
+
+        scheduler = scheduling.ProjectScheduler(len(slices))
+        scheduler.map(fetch, [(index, params)
+                              for (index, params) in enumerate(slices)])
+        # The requests are counted per thread: count the slices' requests
+        # for our own thread too, so that they end up in our timings.
+        scheduling.count_request(sum(slice_requests))
         result = []
+        seen = set()
+        for commit in [commit for slice_result in results
+                       for commit in slice_result]:
+            if isinstance(commit, dict):
+                if commit['sha'] in seen:
+                    continue
+                seen.add(commit['sha'])
+            result.append(commit)
+        return result
+
+    def walk_branches(self, params):
+        """Return the commits of all branches for the since/until params."""
+        result = []
+        seen = set()
         url = COMMITS_URL.format(owner=self.owner, project=self.name)
         for branch_SHA in self.branch_SHAs:
-            result += grab_json(url, params={'since': since(),
-                                             'sha': branch_SHA})
+            if branch_SHA in seen:
+                # Branch that's been merged into a branch we already walked.
+                continue
+            params = dict(params, sha=branch_SHA)
+            next_url = url
+            while next_url:
+                page, next_url = grab_json_page(next_url, params=params)
+                if not isinstance(page, list):
+                    logger.warn("Expected list of commits, got %r", page)
+                    break
+                reached_known_history = False
+                for commit in page:
+                    if isinstance(commit, dict):
+                        if commit['sha'] in seen:
+                            reached_known_history = True
+                            continue
+                        seen.add(commit['sha'])
+                    result.append(commit)
+                if reached_known_history:
+                    break
         return result
 
     def load_individual_commits(self):
-        for commit in self.commits:
+        """Load and count the commits' details, return the Commit objects.
+        """
+        loaded_commits = self.load_commit_details(self.commits)
+        self.add_commits(loaded_commits)
+        return loaded_commits
+
+    def load_commit_details(self, commit_dicts):
+        """Return Commit objects for (part of) our list of commits."""
+        loaded_commits = []
+        for commit in commit_dicts:
             if not isinstance(commit, dict):
                 logger.warn("dict in commit isn't a dict: %r" % commit)
                 logger.debug("the full list of commits:")
                 logger.debug(self.commits)
                 logger.warn("Continuing anyway...")
                 continue
+            loaded_commits.append(self.load_commit(commit))
+        return loaded_commits
+
+    def load_commit(self, commit):
+        """Return Commit, from the checkpoint if we've already fetched it."""
+        facts = None
+        if self.checkpoint is not None:
+            facts = self.checkpoint.commit_facts(commit['url'])
+        if facts is not None:
+            the_commit = Commit.from_facts(facts)
+        else:
             the_commit = Commit(commit)
+            PROGRESS.detail_fetched()
+            if self.checkpoint is not None:
+                self.checkpoint.commit_fetched(the_commit)
+        if self.commit_sink is not None:
+            self.commit_sink.write(self, the_commit)
+        return the_commit
+
+    def add_commits(self, loaded_commits):
+        """Count the commits.
+
+        With a statistics cube, the commits are only added to the cube: our
+        totals and the users' are derived from it afterwards (see
+        :func:`derive_totals`). Without one, we count them ourselves.
+        """
+        for the_commit in loaded_commits:
             if self.restrict_to_known_users:
                 if the_commit.user not in self.users:
                     continue
-            self.users[the_commit.user].add_commit(the_commit)
-            self.add_commit(the_commit)
+            user = self.users[the_commit.user]
+            if self.statistics_cube is None:
+                user.add_commit(the_commit)
+                self.add_commit(the_commit)
+            else:
+                user.name = the_commit.user
+                self.statistics_cube.add_commit(self.key, the_commit)
 
     @property
     def is_active(self):
@@ -223,6 +686,315 @@ class User(TestCommitCounter):
         TestCommitCounter.add_commit(self, commit)
 
 
+class Checkpoint(object):
+    """Collection state that survives an interrupted run.
+
+    While collecting, the organizations' project lists, the facts of every
+    commit whose details we've fetched and the finished projects are
+    appended to a local state file, one json line each. ``--resume``
+    continues from there, so a rerun after a rate limit exhaustion or a
+    Ctrl-C doesn't spend the API quota again. Without a filename, the state
+    is only kept in memory.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.state = {'settings': self.fingerprint(),
+                      'since': since(),
+                      'until': SETTINGS.get('until'),
+                      'repos': {},
+                      'projects': {},
+                      'commits': {}}
+        self.output = None
+        self.unsaved = 0
+        # Worker threads report their commits and projects concurrently.
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def fingerprint():
+        """Return the settings that must be equal for a resume to make sense.
+        """
+        relevant = dict((key, SETTINGS[key]) for key in
+                        ('days', 'organizations', 'extra_projects',
+                         'testfile_rules'))
+        # Round-trip through json to get lists instead of tuples.
+        return json.loads(json.dumps(relevant))
+
+    def resume(self):
+        """Load the state file, return whether we can continue from it."""
+        if not os.path.exists(self.filename):
+            logger.warn("No state file %s found, starting afresh.",
+                        self.filename)
+            return False
+        records = []
+        for line in open(self.filename):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # Half a line: we were interrupted while writing it.
+                break
+        if not records or records[0].get('settings') != self.fingerprint():
+            logger.warn("The settings changed since %s was written, "
+                        "starting afresh.", self.filename)
+            return False
+        self.state['since'] = records[0]['since']
+        self.state['until'] = records[0].get('until')
+        for record in records[1:]:
+            self.apply(record)
+        SETTINGS['since'] = self.state['since']
+        SETTINGS['until'] = self.state['until']
+        # Start with a clean file (without a possible half line) that we
+        # append to.
+        self.start_file('w')
+        for record in records[1:]:
+            self.append(record)
+        self.save()
+        logger.info("Resuming: %s projects were already done.",
+                    len(self.state['projects']))
+        return True
+
+    def apply(self, record):
+        """Update our state with a record from the state file."""
+        if 'repos' in record:
+            self.state['repos'][record['repos']] = record['project_names']
+        elif 'commit' in record:
+            self.state['commits'][record['commit']['url']] = record['commit']
+        elif 'project' in record:
+            self.state['projects'][record['project']] = record['urls']
+
+    def start_file(self, mode):
+        self.output = open(self.filename, mode)
+        self.append({'settings': self.state['settings'],
+                     'since': self.state['since'],
+                     'until': self.state['until']})
+
+    def append(self, record):
+        with self.lock:
+            if not self.filename:
+                return
+            if self.output is None:
+                self.start_file('w')
+            self.output.write(json.dumps(record) + '\n')
+
+    def record(self, record):
+        """Apply the record and append it to the state file."""
+        with self.lock:
+            self.apply(record)
+            self.append(record)
+
+    def repos(self, organization):
+        return self.state['repos'].get(organization)
+
+    def set_repos(self, organization, project_names):
+        with self.lock:
+            self.record({'repos': organization,
+                         'project_names': project_names})
+            self.save()
+
+    def project_commits(self, project):
+        """Return facts of a finished project's commits or None."""
+        urls = self.state['projects'].get(project.key)
+        if urls is None:
+            return None
+        return [self.state['commits'][url] for url in urls]
+
+    def project_done(self, project, loaded_commits):
+        with self.lock:
+            for commit in loaded_commits:
+                if commit.url not in self.state['commits']:
+                    self.record({'commit': commit.facts})
+            self.record({'project': project.key,
+                         'urls': [commit.url for commit in loaded_commits]})
+            self.save()
+
+    def commit_facts(self, url):
+        return self.state['commits'].get(url)
+
+    def commit_fetched(self, commit):
+        with self.lock:
+            self.record({'commit': commit.facts})
+            self.unsaved += 1
+            if self.unsaved >= CHECKPOINT_INTERVAL:
+                self.save()
+
+    def save(self):
+        """Make sure everything we've got is on disk."""
+        with self.lock:
+            self.unsaved = 0
+            if not self.filename:
+                return
+            if self.output is None:
+                self.start_file('w')
+            self.output.flush()
+
+    def finish(self):
+        """Remove the state file: the run completed."""
+        with self.lock:
+            if self.output is not None:
+                self.output.close()
+                self.output = None
+            if self.filename and os.path.exists(self.filename):
+                os.remove(self.filename)
+
+
+def num_pages(req):
+    """Return number of pages according to the response's Link header."""
+    last = req.links.get('last')
+    if not last:
+        return 1
+    match = re.search(r'[?&]page=(\d+)', last['url'])
+    return match and int(match.group(1)) or 1
+
+
+def estimated_count(req):
+    """Return estimated number of items in the paginated list."""
+    page = req.json()
+    if not isinstance(page, list):
+        return 0
+    pages = num_pages(req)
+    if pages == 1:
+        return len(page)
+    # The last page is half full, on average.
+    return len(page) * (pages - 1) + len(page) // 2
+
+
+def plan_project(owner, name):
+    """Return estimate of the API requests collecting a project needs.
+
+    We do the two cheap listing requests (branches and the first page of
+    commits of the default branch) and extrapolate with their Link headers.
+    """
+    branches_req = api_get(BRANCHES_URL.format(owner=owner, project=name))
+    num_branches = estimated_count(branches_req)
+    commits_req = api_get(COMMITS_URL.format(owner=owner, project=name),
+                          params=period_params())
+    num_commits = estimated_count(commits_req)
+    # The branch walk lists one branch completely; the others mostly end
+    # after one page on already known history.
+    listing_requests = num_pages(commits_req) + max(num_branches - 1, 0)
+    return {'project': '{}/{}'.format(owner, name),
+            'branches': num_branches,
+            'commits': num_commits,
+            'requests': (num_pages(branches_req) + listing_requests +
+                         num_commits)}
+
+
+def plan(workers=1):
+    """Return estimated cost of collect_info and the current rate limit.
+
+    Every project costs two requests to plan, so this is a lot cheaper than
+    the real thing. The time is estimated for a run with that many workers.
+    """
+    start = time.time()
+    num_plan_requests = 0
+    total_requests = 0
+    project_plans = []
+    project_specs = []
+    for organization in SETTINGS['organizations']:
+        logger.info("Looking for projects in organization %s...",
+                    organization)
+        req = api_get(ORG_REPOS_URL.format(organization=organization))
+        repos = req.json()
+        if req.links.get('next'):
+            repos = repos + grab_json(req.links['next']['url'])
+        project_names = [repo['name'] for repo in repos]
+        # We need the complete list, just like the real run.
+        num_plan_requests += num_pages(req)
+        total_requests += num_pages(req)
+        project_specs += [(organization, project_name)
+                          for project_name in project_names]
+    project_specs += [tuple(spec) for spec in SETTINGS['extra_projects']]
+    for (owner, name) in project_specs:
+        project_plan = plan_project(owner, name)
+        logger.debug("Planned %s", project_plan['project'])
+        project_plans.append(project_plan)
+        num_plan_requests += 2
+        total_requests += project_plan['requests']
+    seconds_per_request = (time.time() - start) / max(num_plan_requests, 1)
+    rate = grab_json(RATE_LIMIT_URL)['resources']['core']
+    if total_requests <= rate['remaining']:
+        num_windows = 1
+    else:
+        num_windows = 1 + int(math.ceil(
+            (total_requests - rate['remaining']) / rate['limit']))
+    return {'projects': project_plans,
+            'requests': total_requests,
+            'plan_requests': num_plan_requests,
+            'seconds': total_requests * seconds_per_request / workers,
+            'workers': workers,
+            'rate_limit': rate,
+            'rate_limit_windows': num_windows}
+
+
+def print_plan(the_plan):
+    print("""
+API cost plan
+=============
+
+Period: {period} days.
+
+Projects (estimated commits, branches and API requests)
+-------------------------------------------------------
+""".format(period=SETTINGS['days']))
+    for project_plan in the_plan['projects']:
+        print("{project}: ~{commits} commits, {branches} branches, "
+              "~{requests} requests".format(**project_plan))
+    rate = the_plan['rate_limit']
+    reset = datetime.datetime.fromtimestamp(rate['reset'])
+    print("""
+Total
+-----
+
+Estimated API requests: ~{requests} (planning itself took {plan_requests}).
+Estimated time: ~{minutes} minutes with {workers} worker(s).
+Rate limit: {remaining} of {limit} requests remaining, reset at {reset}.
+Rate limit windows needed: {windows}.
+""".format(requests=the_plan['requests'],
+           plan_requests=the_plan['plan_requests'],
+           minutes=int(math.ceil(the_plan['seconds'] / 60)),
+           workers=the_plan['workers'],
+           remaining=rate['remaining'],
+           limit=rate['limit'],
+           reset=reset.strftime('%H:%M'),
+           windows=the_plan['rate_limit_windows']))
+    if the_plan['rate_limit_windows'] == 1:
+        print("That fits in the remaining rate limit.")
+    else:
+        print("That doesn't fit in the remaining rate limit: split the run "
+              "or wait for the reset.")
+
+
+class CommitSink(object):
+    """Write one json line per classified commit as soon as we have it.
+
+    Lines are flushed right away, so a downstream loader can follow the file
+    while we're still collecting.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.output = open(filename, 'w')
+        self.num_written = 0
+        self.lock = threading.Lock()
+
+    def write(self, project, commit):
+        line = json.dumps({'repo': project.key,
+                           'sha': commit.sha,
+                           'committer': commit.user,
+                           'date': commit.date,
+                           'num_testfiles': commit.num_testfiles_changed,
+                           'testfiles': commit.testfiles},
+                          separators=(',', ':'))
+        with self.lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+            self.num_written += 1
+
+    def close(self):
+        self.output.close()
+        logger.info("Wrote %s commits to %s", self.num_written, self.filename)
+
+
 def show_config():
     """Print the current configuration
 
@@ -238,11 +1010,27 @@ The defaults are probably not what you want :-)""")
     sys.exit(0)
 
 
+def positive_int(value):
+    """Return VALUE as an int of at least 1 (argparse type)."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "{} isn't a positive number".format(value))
+    return number
+
+
 def parse_commandline():
     """Parse commandline options and set up logging.
     """
     parser = argparse.ArgumentParser(
         description='Print number of test-related github commits.')
+    parser.add_argument('command',
+                        nargs='?',
+                        choices=['report', 'webhook'],
+                        default='report',
+                        help=("'report' (the default) queries github and "
+                              "prints the report, 'webhook' listens for "
+                              "github push events"))
     parser.add_argument('-v',
                         '--verbose',
                         action='store_true',
@@ -252,6 +1040,79 @@ def parse_commandline():
                         help="export results as json to [FILENAME]",
                         metavar='FILENAME',
                         dest='json_filename')
+    parser.add_argument('--ndjson-output',
+                        help=("write one json line per commit to [FILENAME] "
+                              "while collecting"),
+                        metavar='FILENAME',
+                        dest='ndjson_filename')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help=("continue an interrupted run from %s" %
+                              STATE_FILENAME),
+                        dest='resume')
+    archive_group = parser.add_mutually_exclusive_group()
+    archive_group.add_argument('--record',
+                               help="record all API responses in [DIR]",
+                               metavar='DIR',
+                               dest='record_dir')
+    archive_group.add_argument('--replay',
+                               help=("replay API responses recorded in [DIR] "
+                                     "instead of querying github"),
+                               metavar='DIR',
+                               dest='replay_dir')
+    parser.add_argument('--cache',
+                        help="cache API responses in [DIR]",
+                        metavar='DIR',
+                        dest='cache_dir')
+    parser.add_argument('--cache-size',
+                        help=("maximum size of the cache in MB "
+                              "(default: %s)" % cache.DEFAULT_MAX_SIZE),
+                        type=int,
+                        default=cache.DEFAULT_MAX_SIZE,
+                        metavar='MB',
+                        dest='cache_size')
+    parser.add_argument('--port',
+                        help=("port for the webhook receiver "
+                              "(default: %s)" % WEBHOOK_PORT),
+                        type=int,
+                        default=WEBHOOK_PORT,
+                        dest='port')
+    parser.add_argument('--plan',
+                        action='store_true',
+                        help=("only estimate the API requests and time a run "
+                              "needs, compared to the rate limit"),
+                        dest='plan')
+    parser.add_argument('--workers',
+                        help="number of parallel workers (default: 1)",
+                        type=positive_int,
+                        default=1,
+                        dest='workers')
+    parser.add_argument('--slices',
+                        help=("split the period in [N] time slices that are "
+                              "listed in parallel (for long periods)"),
+                        type=int,
+                        default=1,
+                        metavar='N',
+                        dest='time_slices')
+    parser.add_argument('--deadline',
+                        help=("fetch commit details for at most [SECONDS] "
+                              "and estimate the rest from that sample"),
+                        type=float,
+                        metavar='SECONDS',
+                        dest='deadline')
+    parser.add_argument('--max-requests',
+                        help=("do at most [N] API requests and estimate "
+                              "the rest from a sample of the commits"),
+                        type=int,
+                        metavar='N',
+                        dest='max_requests')
+    parser.add_argument('--profile',
+                        help=("settings profile of one team for a batch run "
+                              "(repeat for more profiles): everything is "
+                              "fetched once for all profiles"),
+                        action='append',
+                        metavar='FILENAME',
+                        dest='profile_filenames')
     parser.add_argument('--show-config',
                         action='store_true',
                         help="show the current configuration",
@@ -260,6 +1121,19 @@ def parse_commandline():
                         action='version',
                         version='%(prog)s ' + __version__)
     args = parser.parse_args()
+    if args.plan and args.replay_dir:
+        # The plan needs github's pagination headers, which aren't archived.
+        parser.error("--plan can't be combined with --replay")
+    if args.record_dir and args.resume:
+        # The projects restored from the state file wouldn't be recorded.
+        parser.error("--record can't be combined with --resume")
+    if args.profile_filenames:
+        if args.deadline is not None or args.max_requests is not None:
+            parser.error("--profile can't be combined with --deadline or "
+                         "--max-requests")
+        if args.json_filename:
+            parser.error("--profile can't be combined with --json-output, "
+                         "set 'json_output' in the profiles instead")
     loglevel = args.verbose and logging.DEBUG or logging.INFO
     logging.basicConfig(level=loglevel,
                         format="%(levelname)s: %(message)s")
@@ -271,44 +1145,277 @@ def parse_commandline():
     return args
 
 
-def collect_info():
+def list_projects(checkpoint):
+    """Return (organization, project name) for our organizations' projects.
+    """
+    result = []
+    for organization in SETTINGS['organizations']:
+        project_names = checkpoint.repos(organization)
+        if project_names is None:
+            logger.info("Looking for projects in organization %s...",
+                        organization)
+            url = ORG_REPOS_URL.format(organization=organization)
+            repos = grab_json(url)
+            project_names = [repo['name'] for repo in repos]
+            checkpoint.set_repos(organization, project_names)
+        result += [(organization, project_name)
+                   for project_name in project_names]
+    return result
+
+
+def load_commits(projects, workers, timings):
+    """Return dict from project key to the project's Commit objects.
+
+    Projects that the checkpoint already has are restored, the rest are
+    loaded by the scheduler's workers.
+    """
+    result = {}
+    to_load = []
+    for project in projects:
+        restored_commits = project.restored_commits()
+        if restored_commits is None:
+            to_load.append(project)
+        else:
+            result[project.key] = restored_commits
+    scheduler = scheduling.ProjectScheduler(workers, timings)
+    result.update(scheduler.run(to_load))
+    return result
+
+
+def collect_sample(all_projects, restored, scheduler, budget, users):
+    """Count all commits, but fetch only a sample of the commit details.
+
+    Every commit is listed, so the number of commits is exact. The details
+    are fetched in stratified random order (one stratum per project and
+    user) until the budget is exhausted. The test commit counts are then
+    estimated per project and per user.
+    """
+    scheduler.run([project for project in all_projects
+                   if restored[project.key] is None],
+                  load_details=False)
+    # Only our own organizations' committers count for the extra projects.
+    known_users = set()
+    listed = []
+    for project in all_projects:
+        if restored[project.key] is not None:
+            project_commits = [(the_commit.user, the_commit)
+                               for the_commit in restored[project.key]]
+        else:
+            project_commits = [(commit['commit']['committer']['name'], commit)
+                               for commit in project.commits
+                               if isinstance(commit, dict)]
+        if not project.restrict_to_known_users:
+            known_users.update(user for (user, commit) in project_commits)
+        listed.append(project_commits)
+
+    strata = defaultdict(list)
+    sampled = defaultdict(list)
+    for index, project in enumerate(all_projects):
+        for user, commit in listed[index]:
+            if project.restrict_to_known_users and user not in known_users:
+                continue
+            strata[(index, user)].append(commit)
+            if isinstance(commit, Commit):
+                # Restored from the checkpoint: we already know everything.
+                sampled[(index, user)].append(commit)
+    unsampled = dict((stratum, commits) for (stratum, commits)
+                     in strata.items() if stratum not in sampled)
+    lock = threading.Lock()
+
+    def fetch(stratum, commit):
+        if budget.exhausted():
+            return
+        the_commit = all_projects[stratum[0]].load_commit(commit)
+        with lock:
+            sampled[stratum].append(the_commit)
+
+    scheduler.map(fetch, sampling.sample_order(unsampled, random.Random()))
+    logger.info("Fetched details of %s of %s commits",
+                sum(len(sample) for sample in sampled.values()),
+                sum(len(commits) for commits in strata.values()))
+
+    estimates = defaultdict(lambda: [0, sampling.Estimate(),
+                                     sampling.Estimate()])
+    for (index, user), commits in strata.items():
+        sample = sampled[(index, user)]
+        for counter in (all_projects[index], users[user]):
+            estimate = estimates[counter]
+            estimate[0] += len(commits)
+            estimate[1].add_stratum(len(commits), [
+                    int(the_commit.is_testcommit) for the_commit in sample])
+            estimate[2].add_stratum(len(commits), [
+                    the_commit.num_testfiles_changed for the_commit in sample])
+        users[user].name = user
+    for counter, (num_commits, testcommits, testfiles) in estimates.items():
+        counter.set_estimate(num_commits, testcommits, testfiles)
+    if all(len(sampled[stratum]) >= len(commits)
+           for stratum, commits in strata.items()):
+        # The budget sufficed: the breakdowns are exact, too.
+        for (index, user), sample in sampled.items():
+            project = all_projects[index]
+            if project.statistics_cube is not None:
+                for the_commit in sample:
+                    project.statistics_cube.add_commit(project.key,
+                                                       the_commit)
+
+
+def derive_totals(projects, users, statistics_cube):
+    """Set the projects' and users' totals from the statistics cube."""
+    project_totals = statistics_cube.totals('project')
+    for project in projects:
+        project.set_totals(project_totals.get(project.key))
+    user_totals = statistics_cube.totals('user')
+    for user in users:
+        user.set_totals(user_totals.get(user.name))
+
+
+def collect_info(checkpoint=None, statistics_cube=None, workers=1,
+                 timings=None, commit_sink=None, budget=None,
+                 time_slices=1):
     """Return collected info on projects and users.
+
+    Progress is stored in the (optional) checkpoint as we go. The counts per
+    user, project and day are added to the (optional) statistics cube, the
+    project and user totals are derived from it. Every commit is written to
+    the (optional) commit sink as soon as it is loaded.
+
+    The projects are loaded by a number of workers, the most expensive ones
+    (according to the timings of the previous run) first. The commits are
+    counted afterwards in the regular order, so the result doesn't depend on
+    which worker finished first.
+
+    With a (sampling.Budget) budget, the test commit counts are estimated
+    from a sample of the commit details, see :func:`collect_sample`.
+
+    With more than one time slice, every project's period is split up in
+    that many slices that are listed in parallel. Handy for long periods.
     """
+    if checkpoint is None:
+        checkpoint = Checkpoint()
+    if timings is None:
+        timings = scheduling.Timings()
+    if statistics_cube is None:
+        statistics_cube = cube.StatisticsCube()
     users = defaultdict(User)
-    projects = []
+    all_projects = []
 
-    for organization in SETTINGS['organizations']:
-        logger.info("Looking for projects in organization %s...",
-                    organization)
-        url = ORG_REPOS_URL.format(organization=organization)
-        repos = grab_json(url)
-        project_names = [repo['name'] for repo in repos]
-        for project_name in project_names:
-            project = Project(organization, project_name, users)
-            project.load()
-            if project.is_active:
-                projects.append(project)
-
-    for (organization, project_name) in SETTINGS['extra_projects']:
-        project = Project(organization, project_name, users,
-                          restrict_to_known_users=True)
-        project.load()
-        if project.is_active:
-            projects.append(project)
-
-    users = users.values()  # Defaultdict isn't handy anymore here.
-    users.sort()
-    projects.sort()
+    try:
+        for (organization, project_name) in list_projects(checkpoint):
+            all_projects.append(Project(organization, project_name, users,
+                                        checkpoint=checkpoint,
+                                        statistics_cube=statistics_cube,
+                                        commit_sink=commit_sink,
+                                        time_slices=time_slices))
+
+        for (organization, project_name) in SETTINGS['extra_projects']:
+            all_projects.append(Project(organization, project_name, users,
+                                        restrict_to_known_users=True,
+                                        checkpoint=checkpoint,
+                                        statistics_cube=statistics_cube,
+                                        commit_sink=commit_sink,
+                                        time_slices=time_slices))
+
+        PROGRESS.start(len(all_projects))
+        if budget is not None:
+            restored = dict((project.key, project.restored_commits())
+                            for project in all_projects)
+            scheduler = scheduling.ProjectScheduler(workers, timings)
+            collect_sample(all_projects, restored, scheduler, budget, users)
+        else:
+            loaded = load_commits(all_projects, workers, timings)
+            for project in all_projects:
+                project.add_commits(loaded[project.key])
+            derive_totals(all_projects, users.values(), statistics_cube)
+        projects = [project for project in all_projects if project.is_active]
+    finally:
+        # Whatever happens (Ctrl-C, rate limit...), keep what we've got.
+        checkpoint.save()
+        timings.save()
+        PROGRESS.finish()
+
+    users = list(users.values())  # Defaultdict isn't handy anymore here.
+    users.sort(key=lambda user: user.sort_key)
+    projects.sort(key=lambda project: project.sort_key)
     return (projects, users)
 
 
-def main():
-    load_custom_settings()
-    args = parse_commandline()
-    projects, users = collect_info()
+def collect_batch(profiles, checkpoint=None, workers=1, timings=None,
+                  commit_sink=None, time_slices=1):
+    """Return (profile, projects, users, statistics cube) per profile.
+
+    SETTINGS must cover all profiles (see :func:`union_settings`). Every
+    project is fetched once for the widest period, after which each
+    profile's report is computed from those shared commits, with the
+    known-users restriction for the profile's own extra projects.
+    """
+    if checkpoint is None:
+        checkpoint = Checkpoint()
+    if timings is None:
+        timings = scheduling.Timings()
+    org_projects = []
+    all_projects = []
+
+    try:
+        org_projects = list_projects(checkpoint)
+        extra_projects = [tuple(extra_project)
+                          for extra_project in SETTINGS['extra_projects']]
+        to_load = org_projects + [extra_project
+                                  for extra_project in extra_projects
+                                  if extra_project not in org_projects]
+        for (owner, project_name) in to_load:
+            # Users are counted per profile below.
+            all_projects.append(Project(owner, project_name, {},
+                                        checkpoint=checkpoint,
+                                        commit_sink=commit_sink,
+                                        time_slices=time_slices))
+        PROGRESS.start(len(all_projects))
+        loaded = load_commits(all_projects, workers, timings)
+    finally:
+        checkpoint.save()
+        timings.save()
+        PROGRESS.finish()
+
+    result = []
+    for profile in profiles:
+        start = profile_since(profile)
+        users = defaultdict(User)
+        statistics_cube = cube.StatisticsCube()
+        profile_projects = [
+            Project(owner, project_name, users,
+                    statistics_cube=statistics_cube)
+            for (owner, project_name) in org_projects
+            if owner in profile['organizations']]
+        profile_projects += [
+            Project(owner, project_name, users, restrict_to_known_users=True,
+                    statistics_cube=statistics_cube)
+            for (owner, project_name) in profile['extra_projects']]
+        for project in profile_projects:
+            project.add_commits([the_commit
+                                 for the_commit in loaded[project.key]
+                                 if the_commit.date[:19] >= start])
+        derive_totals(profile_projects, users.values(), statistics_cube)
+        projects = [project for project in profile_projects
+                    if project.is_active]
+        users = list(users.values())
+        users.sort(key=lambda user: user.sort_key)
+        projects.sort(key=lambda project: project.sort_key)
+        result.append((profile, projects, users, statistics_cube))
+    return result
+
+
+def print_report(projects, users, settings=None):
+    """Print the report, by default for our own settings.
+
+    For a batch run, pass the profile as ``settings``.
+    """
+    if settings is None:
+        settings = SETTINGS
+    title = 'Test statistics'
+    if settings.get('name'):
+        title += ': ' + settings['name']
     print("""
-Test statistics
-===============
+{title}
+{underline}
 
 We want more and better testing. For a quick and dirty quantity
 indication ('more'), here are the commits that have the string
@@ -316,12 +1423,18 @@ indication ('more'), here are the commits that have the string
 
 Period: {period} days.
 Github organizations that I queried: {orgs}
-
-Projects sorted by amount of commits with tests
+""".format(title=title,
+           underline='=' * len(title),
+           period=settings['days'],
+           orgs=', '.join(settings['organizations'])))
+    if any(counter.is_estimate for counter in projects + users):
+        print("""Figures marked with ~ are estimates from a random sample of
+the commits. The +/- gives the 95% confidence interval.
+""")
+    print("""Projects sorted by amount of commits with tests
 -----------------------------------------------
 
-""".format(period=SETTINGS['days'],
-            orgs=', '.join(SETTINGS['organizations'])))
+""")
     for project in projects:
         project.print_info()
     print("""
@@ -332,11 +1445,99 @@ Committers sorted by amount of commits with tests
 """)
     for user in users:
         user.print_info()
+
+
+def write_json(filename, projects, users, statistics_cube):
+    output = {'projects': [project.as_dict() for project in projects],
+              'users': [user.as_dict() for user in users]}
+    if not any(counter.is_estimate for counter in projects + users):
+        # A sampled run doesn't have the breakdowns.
+        output['users_per_project'] = statistics_cube.pivot('project',
+                                                            'user')
+        output['days'] = statistics_cube.trend()
+    open(filename, 'w').write(json.dumps(output, indent=2))
+    logger.info("Wrote results to %s", filename)
+
+
+def main():
+    load_custom_settings()
+    args = parse_commandline()
+    if args.command == 'webhook':
+        from githubinfo import webhook
+        webhook.serve(port=args.port)
+        return
+    profiles = None
+    if args.profile_filenames:
+        profiles = [load_profile(filename)
+                    for filename in args.profile_filenames]
+        # Fetch everything once, for all profiles.
+        SETTINGS.update(union_settings(profiles))
+    if args.replay_dir:
+        replayer = archive.Replayer(args.replay_dir)
+        # The recorded requests are for the recorded period. Older archives
+        # don't have an 'until'.
+        SETTINGS['since'] = replayer.metadata['since']
+        SETTINGS['until'] = replayer.metadata.get('until')
+        RESPONSE_STORES.append(replayer)
+    else:
+        SETTINGS['until'] = datetime.datetime.now().isoformat()
+    # Freeze the period so that all projects (and a resumed run) use the
+    # same one.
+    SETTINGS['since'] = since()
+    if args.plan:
+        print_plan(plan(workers=args.workers))
+        return
+    checkpoint = Checkpoint(STATE_FILENAME)
+    if args.resume:
+        checkpoint.resume()
+    if args.record_dir:
+        RESPONSE_STORES.append(archive.Recorder(
+                args.record_dir, {'since': since(),
+                                  'until': SETTINGS['until']}))
+    if args.cache_dir:
+        RESPONSE_STORES.append(cache.ResponseCache(args.cache_dir,
+                                                   args.cache_size))
+    PROGRESS.enable(sys.stderr)
+    statistics_cube = cube.StatisticsCube()
+    commit_sink = None
+    if args.ndjson_filename:
+        commit_sink = CommitSink(args.ndjson_filename)
+    budget = None
+    if args.deadline is not None or args.max_requests is not None:
+        budget = sampling.Budget(lambda: PROGRESS.requests,
+                                 deadline=args.deadline,
+                                 max_requests=args.max_requests)
+    # A replayed run's timings say nothing about a real run.
+    timings = scheduling.Timings(None if args.replay_dir else
+                                 TIMINGS_FILENAME)
+    try:
+        if profiles:
+            results = collect_batch(
+                profiles, checkpoint, workers=args.workers,
+                timings=timings,
+                commit_sink=commit_sink, time_slices=args.time_slices)
+        else:
+            projects, users = collect_info(
+                checkpoint, statistics_cube, workers=args.workers,
+                timings=timings,
+                commit_sink=commit_sink, budget=budget,
+                time_slices=args.time_slices)
+    finally:
+        for response_store in RESPONSE_STORES:
+            response_store.close()
+        if commit_sink is not None:
+            commit_sink.close()
+    checkpoint.finish()
+    if profiles:
+        for profile, projects, users, statistics_cube in results:
+            print_report(projects, users, profile)
+            if profile.get('json_output'):
+                write_json(profile['json_output'], projects, users,
+                           statistics_cube)
+        return
+    print_report(projects, users)
     if args.json_filename:
-        output = {'projects': [project.as_dict() for project in projects],
-                  'users': [user.as_dict() for user in users]}
-        open(args.json_filename, 'w').write(json.dumps(output, indent=2))
-        logger.info("Wrote results to %s", args.json_filename)
+        write_json(args.json_filename, projects, users, statistics_cube)
 
 
 if __name__ == '__main__':
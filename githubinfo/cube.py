@@ -0,0 +1,118 @@
+"""Commit statistics per user, per project and per day.
+
+The per-user and per-project totals only answer one question. The cube keeps
+the counts per (user, project, day) cell, so breakdowns like "per user per
+project" or "test commits per day" can be computed afterwards instead of
+with another collection run.
+
+The cells are stored column-wise in compact ``array`` objects: one column
+per dimension index and one per count. The per-user and per-project totals
+of a collection run are reductions of the cube, too. A reduction assigns
+every row to its group once and then sums every count column into an array
+of group totals. Numpy isn't a dependency, so those are plain loops over the
+arrays, not vectorized operations.
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from array import array
+
+AXES = ('user', 'project', 'day')
+MEASURES = ('num_commits', 'num_testcommits', 'testfiles_changed')
+
+
+class Dimension(object):
+    """Mapping between names and indexes for one axis of the cube."""
+
+    def __init__(self):
+        self.names = []
+        self.indexes = {}
+
+    def index(self, name):
+        if name not in self.indexes:
+            self.indexes[name] = len(self.names)
+            self.names.append(name)
+        return self.indexes[name]
+
+
+class StatisticsCube(object):
+    """Commits, test commits and test files per user, project and day."""
+
+    def __init__(self):
+        self.dimensions = dict((axis, Dimension()) for axis in AXES)
+        self.coordinates = dict((axis, array(str('l'))) for axis in AXES)
+        self.measures = dict((measure, array(str('l')))
+                             for measure in MEASURES)
+        self.cells = {}  # (user, project, day) indexes to row number.
+
+    def __len__(self):
+        return len(self.cells)
+
+    def add_commit(self, project, commit):
+        """Count the commit for the project (a name like 'owner/project')."""
+        cell = (self.dimensions['user'].index(commit.user),
+                self.dimensions['project'].index(project),
+                self.dimensions['day'].index(commit.date[:10]))
+        row = self.cells.get(cell)
+        if row is None:
+            row = len(self.cells)
+            self.cells[cell] = row
+            for axis, index in zip(AXES, cell):
+                self.coordinates[axis].append(index)
+            for measure in MEASURES:
+                self.measures[measure].append(0)
+        self.measures['num_commits'][row] += 1
+        if commit.is_testcommit:
+            self.measures['num_testcommits'][row] += 1
+            self.measures['testfiles_changed'][row] += (
+                commit.num_testfiles_changed)
+
+    def reduce(self, *axes):
+        """Return the measures summed per combination of the given axes.
+
+        The result is a dict from a tuple of names (one per axis) to a dict
+        with the measures.
+        """
+        groups = {}  # Tuple of indexes to group number.
+        row_groups = array(str('l'))
+        for key in zip(*[self.coordinates[axis] for axis in axes]):
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = len(groups)
+            row_groups.append(group)
+        sums = {}
+        for measure in MEASURES:
+            totals = array(str('l'), [0]) * len(groups)
+            for group, value in zip(row_groups, self.measures[measure]):
+                totals[group] += value
+            sums[measure] = totals
+        result = {}
+        for key, group in groups.items():
+            names = tuple(self.dimensions[axis].names[index]
+                          for axis, index in zip(axes, key))
+            result[names] = dict((measure, sums[measure][group])
+                                 for measure in MEASURES)
+        return result
+
+    def totals(self, axis):
+        """Return measures per name of the axis."""
+        return dict((names[0], measures)
+                    for names, measures in self.reduce(axis).items())
+
+    def pivot(self, row_axis, column_axis):
+        """Return nested dict: row name -> column name -> measures."""
+        result = {}
+        for (row, column), measures in self.reduce(row_axis,
+                                                   column_axis).items():
+            result.setdefault(row, {})[column] = measures
+        return result
+
+    def trend(self):
+        """Return list of measures per day, sorted by day."""
+        result = []
+        for day, measures in sorted(self.totals('day').items()):
+            measures = dict(measures)
+            measures['day'] = day
+            result.append(measures)
+        return result
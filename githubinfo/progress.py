@@ -0,0 +1,143 @@
+"""Progress and throughput of a collection run.
+
+On a terminal, the progress is shown as a single line that is updated in
+place. Otherwise (cron, a log file) it is logged every now and then as a
+``key=value`` record, which is also attached to the log record as its
+``progress`` attribute.
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+import logging
+import threading
+import time
+
+TTY_INTERVAL = 0.5  # Seconds between updates of the progress line.
+LOG_INTERVAL = 30  # Seconds between progress log records.
+
+logger = logging.getLogger(__name__)
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '?'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '{}h{:02d}m'.format(hours, minutes)
+    return '{}m{:02d}s'.format(minutes, seconds)
+
+
+class Progress(object):
+    """Counters of a run. Nothing is shown until :meth:`enable` is called.
+    """
+
+    def __init__(self):
+        self.stream = None
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.last_report = 0
+        self.num_projects = 0
+        self.projects_done = 0
+        self.commits_listed = 0
+        self.details_fetched = 0
+        self.requests = 0
+        self.cache_hits = 0
+        self.rate_limit_remaining = None
+
+    def enable(self, stream):
+        self.stream = stream
+        self.is_tty = hasattr(stream, 'isatty') and stream.isatty()
+
+    def start(self, num_projects):
+        with self.lock:
+            self.reset()
+            self.num_projects = num_projects
+        self.report(force=True)
+
+    def response(self, cached=False, rate_limit_remaining=None):
+        with self.lock:
+            if cached:
+                self.cache_hits += 1
+            else:
+                self.requests += 1
+            if rate_limit_remaining is not None:
+                self.rate_limit_remaining = int(rate_limit_remaining)
+        self.report()
+
+    def listed(self, num_commits):
+        with self.lock:
+            self.commits_listed += num_commits
+        self.report()
+
+    def detail_fetched(self):
+        with self.lock:
+            self.details_fetched += 1
+        self.report()
+
+    def project_done(self):
+        with self.lock:
+            self.projects_done += 1
+        self.report()
+
+    def as_dict(self):
+        elapsed = max(time.time() - self.started, 0.001)
+        num_responses = self.requests + self.cache_hits
+        eta = None
+        if self.projects_done:
+            eta = (elapsed / self.projects_done *
+                   (self.num_projects - self.projects_done))
+        return {'projects_done': self.projects_done,
+                'projects': self.num_projects,
+                'commits_listed': self.commits_listed,
+                'details_fetched': self.details_fetched,
+                'requests_per_second': round(self.requests / elapsed, 1),
+                'cache_hit_rate': (num_responses and
+                                   round(self.cache_hits / num_responses, 2)),
+                'rate_limit_remaining': self.rate_limit_remaining,
+                'elapsed': round(elapsed),
+                'eta': None if eta is None else round(eta)}
+
+    def report(self, force=False):
+        if self.stream is None:
+            return
+        interval = self.is_tty and TTY_INTERVAL or LOG_INTERVAL
+        with self.lock:
+            now = time.time()
+            if not force and now - self.last_report < interval:
+                return
+            self.last_report = now
+            info = self.as_dict()
+        if self.is_tty:
+            shown = dict(info)
+            shown['hit_percentage'] = int(100 * info['cache_hit_rate'])
+            if shown['rate_limit_remaining'] is None:
+                shown['rate_limit_remaining'] = '?'
+            shown['eta'] = format_duration(info['eta'])
+            line = ("{projects_done}/{projects} projects, "
+                    "{commits_listed} commits, "
+                    "{details_fetched} details, "
+                    "{requests_per_second} req/s, "
+                    "cache {hit_percentage}%, "
+                    "rate limit {rate_limit_remaining}, "
+                    "ETA {eta}").format(**shown)
+            # \x1b[K clears the rest of the previous, possibly longer, line.
+            self.stream.write('\r' + line + '\x1b[K')
+            self.stream.flush()
+        else:
+            logger.info("Progress: %s",
+                        ' '.join('{}={}'.format(key, info[key])
+                                 for key in sorted(info)),
+                        extra={'progress': info})
+
+    def finish(self):
+        if self.stream is None:
+            return
+        self.report(force=True)
+        if self.is_tty:
+            self.stream.write('\n')
+            self.stream.flush()
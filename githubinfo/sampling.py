@@ -0,0 +1,110 @@
+"""Estimate test commit counts from a sample of the commit details.
+
+Listing commits is cheap (a page has up to 100 of them), fetching their
+details costs one request per commit. When the deadline or the request budget
+doesn't allow fetching all details, we fetch them for a stratified random
+sample instead: one stratum per (project, user) combination. The number of
+commits is still exact, the number of test commits becomes an estimate with a
+95% confidence interval.
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+import math
+import time
+
+Z_95 = 1.96
+# Fraction of test commits we assume for a stratum without any sample.
+UNKNOWN_FRACTION = 0.5
+
+
+class Budget(object):
+    """Deadline (in seconds from now) and/or a maximum number of requests.
+
+    ``num_requests`` is a function that returns the number of requests
+    done so far.
+    """
+
+    def __init__(self, num_requests, deadline=None, max_requests=None):
+        self.num_requests = num_requests
+        self.end = deadline is not None and time.time() + deadline or None
+        self.max_requests = max_requests
+
+    def exhausted(self):
+        if self.end is not None and time.time() >= self.end:
+            return True
+        if (self.max_requests is not None and
+                self.num_requests() >= self.max_requests):
+            return True
+        return False
+
+
+def sample_order(strata, rng):
+    """Return (stratum, item) tuples in the order we should sample them.
+
+    First one random item of every stratum (so every stratum gets at least
+    one sample if at all possible), then the rest in random order,
+    interleaved in proportion to the size of the strata.
+    """
+    firsts = []
+    rest = []
+    for stratum in sorted(strata):
+        items = list(strata[stratum])
+        rng.shuffle(items)
+        size = len(items)
+        for rank, item in enumerate(items):
+            position = (rank + rng.random()) / size
+            if rank == 0:
+                firsts.append((position, stratum, item))
+            else:
+                rest.append((position, stratum, item))
+    firsts.sort(key=lambda entry: entry[0])
+    rest.sort(key=lambda entry: entry[0])
+    return [(stratum, item) for (position, stratum, item) in firsts + rest]
+
+
+class Estimate(object):
+    """Estimated total over a number of strata, with a 95% margin."""
+
+    def __init__(self):
+        self.total = 0.0
+        self.variance = 0.0
+        self.exact = True
+
+    def add_stratum(self, size, sample, fallback_fraction=UNKNOWN_FRACTION):
+        """Add a stratum of SIZE items of which SAMPLE are the sampled values.
+
+        A value is 1 or 0 (test commit or not) or, for instance, a number of
+        test files.
+        """
+        num_sampled = len(sample)
+        if num_sampled >= size:
+            self.total += sum(sample)
+            return
+        self.exact = False
+        if not num_sampled:
+            # Nothing to go on: the whole range is possible.
+            self.total += size * fallback_fraction
+            self.variance += (size * max(fallback_fraction, 0.5)) ** 2
+            return
+        mean = sum(sample) / num_sampled
+        if num_sampled > 1:
+            sample_variance = (sum((value - mean) ** 2 for value in sample) /
+                               (num_sampled - 1))
+        else:
+            # One sample tells us nothing about the spread: be careful.
+            sample_variance = max(mean * (1 - mean), 0.25)
+        finite_population_correction = 1 - num_sampled / size
+        self.total += size * mean
+        self.variance += (size ** 2 * finite_population_correction *
+                          sample_variance / num_sampled)
+
+    @property
+    def value(self):
+        return int(round(self.total))
+
+    @property
+    def margin(self):
+        """Return half the width of the 95% confidence interval."""
+        return int(math.ceil(Z_95 * math.sqrt(self.variance)))
@@ -0,0 +1,219 @@
+"""Load projects in parallel, biggest projects first.
+
+With several workers, the run time is easily dominated by one big project
+that happens to be picked up last. So we remember how much work (API
+requests and seconds) every project took in the previous run and start with
+the most expensive ones. A project's commit details are fetched in chunks
+that any idle worker can pick up, so one huge project is spread over all
+workers.
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # Python 2.
+    import Queue as queue
+
+DETAIL_CHUNK_SIZE = 25  # Commit details per task.
+# Unknown projects are scheduled first: they could be anything.
+UNKNOWN_COST = float('inf')
+# Task priorities, lowest first. Detail chunks of started projects go before
+# the next project, projects go by their expected cost.
+CHUNK_PRIORITY = (0, 0)
+STOP_PRIORITY = (2, 0)
+
+logger = logging.getLogger(__name__)
+_counter = threading.local()
+
+
+def count_request(number=1):
+    """Count (a number of) API requests for the current thread."""
+    _counter.requests = num_requests() + number
+
+
+def num_requests():
+    """Return the number of API requests done by the current thread."""
+    return getattr(_counter, 'requests', 0)
+
+
+class Timings(object):
+    """The requests and (summed) seconds per project of the previous run.
+
+    A project's numbers of this run only replace the previous ones when the
+    project finished and needed real API requests: an interrupted project or
+    one served from the cache says nothing about the next real run. Without
+    a filename, they're only kept in memory.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.timings = {}
+        if filename and os.path.exists(filename):
+            self.timings = json.loads(open(filename).read())
+        self.current = {}
+        self.lock = threading.Lock()
+
+    def expected_cost(self, project):
+        timing = self.timings.get(project.key)
+        if timing is None:
+            return UNKNOWN_COST
+        return timing['seconds']
+
+    def reset(self, project):
+        with self.lock:
+            self.current[project.key] = {'requests': 0, 'seconds': 0}
+
+    def add(self, project, requests, seconds):
+        with self.lock:
+            timing = self.current[project.key]
+            timing['requests'] += requests
+            timing['seconds'] += seconds
+
+    def finish(self, project):
+        """Keep the project's numbers of this run for the next one."""
+        with self.lock:
+            timing = self.current.pop(project.key)
+            if timing['requests']:
+                self.timings[project.key] = timing
+
+    def save(self):
+        if not self.filename:
+            return
+        with self.lock:
+            open(self.filename, 'w').write(
+                json.dumps(self.timings, indent=2, sort_keys=True))
+
+
+class ProjectScheduler(object):
+    """Load the projects' commits with a number of worker threads."""
+
+    def __init__(self, workers=1, timings=None):
+        self.workers = workers
+        self.timings = timings or Timings()
+        self.tasks = queue.PriorityQueue()
+        self.sequence = 0  # Tie-breaker that keeps the queue FIFO.
+        self.lock = threading.Lock()
+        self.chunks = {}
+        self.chunks_todo = {}
+        self.error = None
+        self.load_details = True
+
+    def add_task(self, priority, function, *args):
+        with self.lock:
+            self.sequence += 1
+            self.tasks.put((priority, self.sequence, (function, args)))
+
+    def run(self, projects, load_details=True):
+        """Return dict from project key to the list of loaded Commits.
+
+        Without ``load_details``, only the projects' list of commits is
+        loaded.
+        """
+        self.load_details = load_details
+        for project in sorted(projects, key=self.timings.expected_cost,
+                              reverse=True):
+            priority = (1, -self.timings.expected_cost(project))
+            self.timings.reset(project)
+            self.add_task(priority, self.list_project, project)
+        self.execute()
+        result = {}
+        for key, chunks in self.chunks.items():
+            result[key] = [commit for chunk in chunks for commit in chunk]
+        return result
+
+    def map(self, function, items):
+        """Call function(*item) for every item, in order, with our workers.
+        """
+        for item in items:
+            self.add_task(CHUNK_PRIORITY, function, *item)
+        self.execute()
+
+    def execute(self):
+        """Let the workers handle all tasks."""
+        if self.workers <= 1:
+            self.work(block=False)
+        else:
+            threads = [threading.Thread(target=self.work)
+                       for i in range(self.workers)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            self.tasks.join()
+            for thread in threads:
+                self.tasks.put((STOP_PRIORITY, 0, None))
+            for thread in threads:
+                thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def work(self, block=True):
+        while True:
+            try:
+                priority, sequence, task = self.tasks.get(block=block)
+            except queue.Empty:
+                return
+            if task is None:
+                self.tasks.task_done()
+                return
+            function, args = task
+            try:
+                if self.error is None:
+                    function(*args)
+            except Exception as e:
+                # execute() re-raises it, including the traceback.
+                project = args and getattr(args[0], 'key', None)
+                logger.warn("Error in %s%s: %s", function.__name__,
+                            project and ' of ' + project or '', e)
+                self.error = e
+            finally:
+                self.tasks.task_done()
+
+    def timed(self, project, function, *args):
+        start = time.time()
+        requests_before = num_requests()
+        result = function(*args)
+        self.timings.add(project,
+                         num_requests() - requests_before,
+                         time.time() - start)
+        return result
+
+    def list_project(self, project):
+        logger.debug("Loading project {}...".format(project.name))
+        self.timed(project, project.load_listing)
+        if not self.load_details:
+            project.listing_done()
+            return
+        commit_dicts = project.commits
+        num_chunks = max(1, (len(commit_dicts) + DETAIL_CHUNK_SIZE - 1) //
+                         DETAIL_CHUNK_SIZE)
+        with self.lock:
+            self.chunks[project.key] = [[] for i in range(num_chunks)]
+            self.chunks_todo[project.key] = num_chunks
+        if num_chunks == 1:
+            # Not worth handing out to other workers.
+            self.load_chunk(project, 0, commit_dicts)
+            return
+        for index in range(num_chunks):
+            start = index * DETAIL_CHUNK_SIZE
+            self.add_task(CHUNK_PRIORITY, self.load_chunk, project, index,
+                          commit_dicts[start:start + DETAIL_CHUNK_SIZE])
+
+    def load_chunk(self, project, index, commit_dicts):
+        loaded_commits = self.timed(project, project.load_commit_details,
+                                    commit_dicts)
+        with self.lock:
+            self.chunks[project.key][index] = loaded_commits
+            self.chunks_todo[project.key] -= 1
+            finished = not self.chunks_todo[project.key]
+        if finished:
+            self.timings.finish(project)
+            project.done([commit for chunk in self.chunks[project.key]
+                          for commit in chunk])
@@ -2,16 +2,35 @@ from __future__ import unicode_literals
 from __future__ import print_function
 from __future__ import division
 from __future__ import absolute_import
+from collections import defaultdict
 
+import contextlib
 import copy
 import datetime
+import hashlib
+import hmac
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 import mock
 
 import pkg_resources
+import requests
 
 import githubinfo
+from githubinfo import archive
+from githubinfo import cache
 from githubinfo import commits
+from githubinfo import cube
+from githubinfo import progress
+from githubinfo import sampling
+from githubinfo import scheduling
+from githubinfo import webhook
 
 FIXED_DATE = datetime.datetime(year=1972, month=12, day=25)
 
@@ -49,8 +68,23 @@ class UtilitiesTest(unittest.TestCase):
         new_settings = copy.deepcopy(commits.SETTINGS)
         new_settings['auth'] = ['atilla_the_hun', 'nonexisting_password']
         with mock.patch('githubinfo.commits.SETTINGS', new_settings):
-            result = commits.grab_json(url)
-            self.assertEquals({'message': 'Bad credentials'}, result)
+            # Bad credentials: not something to count.
+            self.assertRaises(commits.GithubError, commits.grab_json, url)
+
+    @mock.patch('requests.get')
+    def test_grab_json_with_bad_credentials(self, patched_get):
+        patched_get.return_value.status_code = 401
+        patched_get.return_value.json.return_value = {
+            'message': 'Bad credentials'}
+        new_settings = copy.deepcopy(commits.SETTINGS)
+        new_settings['auth'] = ['atilla_the_hun', 'nonexisting_password']
+        with mock.patch('githubinfo.commits.SETTINGS', new_settings):
+            self.assertRaises(commits.GithubError, commits.grab_json,
+                              'https://api.github.com/rate_limit')
+        # Retried once, with the auth as a tuple.
+        self.assertEquals(patched_get.call_count, 2)
+        self.assertEquals(patched_get.call_args[1]['auth'],
+                          ('atilla_the_hun', 'nonexisting_password'))
 
     def test_grab_paginated_json(self):
         # This hits a real URL and incurs a rate limit...
@@ -255,11 +289,43 @@ class ProjectTest(unittest.TestCase):
         self.project.branch_SHAs = []
         self.assertEquals(self.project.load_project_commits(), [])
 
-    @mock.patch('githubinfo.commits.grab_json', lambda url, params: ['a'])
+    @mock.patch('githubinfo.commits.grab_json_page',
+                lambda url, params: ([{'sha': 'a'}], None))
     def test_load_project_commits2(self):
+        # Commits shared by two branches are only returned once.
         self.project.branch_SHAs = ['fsdfwrwesdfsdfsdf',
                                     'dfsdrrterdxcxcvcx']
-        self.assertEquals(self.project.load_project_commits(), ['a', 'a'])
+        self.assertEquals(self.project.load_project_commits(), [{'sha': 'a'}])
+
+    def test_load_project_commits3(self):
+        # Pagination of the second branch stops at the first known commit.
+        pages = {
+            ('master', commits.COMMITS_URL.format(
+                    owner='nens', project='githubinfo')):
+                ([{'sha': 'master1'}, {'sha': 'base'}], None),
+            ('feature', commits.COMMITS_URL.format(
+                    owner='nens', project='githubinfo')):
+                ([{'sha': 'feature1'}, {'sha': 'base'}], 'http://next/page'),
+            }
+
+        def mock_grab_json_page(url, params):
+            return pages[(params['sha'], url)]
+
+        self.project.branch_SHAs = ['master', 'feature']
+        with mock.patch('githubinfo.commits.grab_json_page',
+                        mock_grab_json_page):
+            result = self.project.load_project_commits()
+        self.assertEquals([commit['sha'] for commit in result],
+                          ['master1', 'base', 'feature1'])
+
+    def test_load_project_commits4(self):
+        # A branch head we've already seen isn't queried at all.
+        self.project.branch_SHAs = ['master', 'base']
+        with mock.patch('githubinfo.commits.grab_json_page') as patched:
+            patched.return_value = ([{'sha': 'master'}, {'sha': 'base'}],
+                                    None)
+            self.project.load_project_commits()
+            self.assertEquals(patched.call_count, 1)
 
     @mock.patch('githubinfo.commits.Commit', MockCommit)
     def test_load_individual_commits(self):
@@ -286,3 +352,1144 @@ class ProjectTest(unittest.TestCase):
         self.project.commits = [{'some': 'dict'}]
         self.project.load_individual_commits()
         self.assertEquals(self.project.num_commits, 0)
+
+
+def mock_grab_json_for_collect_info(url, params=None):
+    if url == commits.ORG_REPOS_URL.format(organization='nens'):
+        return [{'name': 'githubinfo'}]
+    if url.endswith('/branches'):
+        return [{'commit': {'sha': 'asdfghjkl'}}]
+    if url.endswith('/commits'):
+        return [{'sha': 'commit1',
+                 'commit': {'committer': {'name': 'reinout'}},
+                 'url': 'http://example.org/commit1'}]
+    return {'files': [{'filename': 'myproject/tests.py'}]}
+
+
+def mock_grab_json_page_for_collect_info(url, params=None):
+    return mock_grab_json_for_collect_info(url, params), None
+
+
+def nens_settings():
+    """Return a copy of our settings with only the (mocked) nens org."""
+    settings = copy.deepcopy(commits.SETTINGS)
+    settings['organizations'] = ['nens']
+    settings['extra_projects'] = []
+    return settings
+
+
+@contextlib.contextmanager
+def mocked_github(settings,
+                  grab_json=mock_grab_json_for_collect_info,
+                  grab_json_page=mock_grab_json_page_for_collect_info):
+    """Use the settings and the mocked API (by default the nens org)."""
+    with mock.patch('githubinfo.commits.SETTINGS', settings):
+        with mock.patch('githubinfo.commits.grab_json', grab_json):
+            with mock.patch('githubinfo.commits.grab_json_page',
+                            grab_json_page):
+                yield
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'state.jsonl')
+        self.settings = nens_settings()
+        self.settings['since'] = '1972-12-18T00:00:00'
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_commit_facts(self):
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            checkpoint = commits.Checkpoint(self.filename)
+            checkpoint.commit_fetched(commits.Commit.from_facts(
+                    {'url': 'http://example.org/commit1',
+                     'user': 'reinout',
+                     'num_testfiles_changed': 2}))
+            checkpoint.save()
+            resumed = commits.Checkpoint(self.filename)
+            self.assertTrue(resumed.resume())
+            self.assertEquals(
+                resumed.commit_facts('http://example.org/commit1')['user'],
+                'reinout')
+
+    def test_resume_restores_until(self):
+        self.settings['until'] = '1972-12-25T00:00:00'
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            commits.Checkpoint(self.filename).save()
+            self.settings['until'] = '2013-04-01T00:00:00'
+            self.assertTrue(commits.Checkpoint(self.filename).resume())
+            self.assertEquals(commits.period_params(),
+                              {'since': '1972-12-18T00:00:00',
+                               'until': '1972-12-25T00:00:00'})
+
+    def test_resume_with_changed_testfile_rules(self):
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            commits.Checkpoint(self.filename).save()
+            self.settings['testfile_rules'] = {'include': ['spec/*']}
+            self.assertFalse(commits.Checkpoint(self.filename).resume())
+
+    def test_resume_without_file(self):
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            checkpoint = commits.Checkpoint(self.filename)
+            self.assertFalse(checkpoint.resume())
+
+    def test_resume_with_changed_settings(self):
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            commits.Checkpoint(self.filename).save()
+            self.settings['days'] = 42
+            self.assertFalse(commits.Checkpoint(self.filename).resume())
+
+    def test_interrupted_run_is_resumed(self):
+        with mocked_github(self.settings):
+            projects, users = commits.collect_info(
+                commits.Checkpoint(self.filename))
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            checkpoint = commits.Checkpoint(self.filename)
+            self.assertTrue(checkpoint.resume())
+            # Everything is in the checkpoint, so no grab_json calls.
+            with mock.patch('githubinfo.commits.grab_json') as patched:
+                resumed_projects, resumed_users = commits.collect_info(
+                    checkpoint)
+                self.assertFalse(patched.called)
+        self.assertEquals([project.as_dict() for project in projects],
+                          [project.as_dict() for project in resumed_projects])
+        self.assertEquals([user.as_dict() for user in users],
+                          [user.as_dict() for user in resumed_users])
+
+    def test_commits_are_appended(self):
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            checkpoint = commits.Checkpoint(self.filename)
+            for sha in ['commit1', 'commit2']:
+                checkpoint.commit_fetched(commits.Commit.from_facts(
+                        {'url': 'http://example.org/' + sha,
+                         'user': 'reinout',
+                         'num_testfiles_changed': 0}))
+            checkpoint.save()
+            # The header plus one line per commit.
+            self.assertEquals(len(open(self.filename).readlines()), 3)
+
+    def test_resume_after_half_a_line(self):
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            checkpoint = commits.Checkpoint(self.filename)
+            checkpoint.project_done(
+                commits.Project('nens', 'githubinfo', {}),
+                [commits.Commit.from_facts({'url': 'http://example.org/c1',
+                                            'user': 'reinout',
+                                            'num_testfiles_changed': 1})])
+            open(self.filename, 'a').write('{"commit": {"url": "htt')
+            resumed = commits.Checkpoint(self.filename)
+            self.assertTrue(resumed.resume())
+            resumed.commit_fetched(commits.Commit.from_facts(
+                    {'url': 'http://example.org/c2',
+                     'user': 'reinout',
+                     'num_testfiles_changed': 0}))
+            resumed.save()
+            again = commits.Checkpoint(self.filename)
+            self.assertTrue(again.resume())
+        self.assertEquals(
+            [facts['url'] for facts in again.project_commits(
+                    commits.Project('nens', 'githubinfo', {}))],
+            ['http://example.org/c1'])
+        self.assertTrue(again.commit_facts('http://example.org/c2'))
+
+    def test_error_isnt_checkpointed(self):
+        def mock_grab_json(url, params=None):
+            if url == 'http://example.org/commit1':
+                raise commits.GithubError("Rate limit")
+            return mock_grab_json_for_collect_info(url, params)
+
+        def mock_grab_json_page(url, params=None):
+            if url.endswith('/commits'):
+                raise commits.GithubError("Rate limit")
+            return mock_grab_json_page_for_collect_info(url, params)
+
+        for grab_json, grab_json_page in [
+                (mock_grab_json, mock_grab_json_page_for_collect_info),
+                (mock_grab_json_for_collect_info, mock_grab_json_page)]:
+            with mocked_github(self.settings, grab_json, grab_json_page):
+                self.assertRaises(commits.GithubError,
+                                  commits.collect_info,
+                                  commits.Checkpoint(self.filename))
+                checkpoint = commits.Checkpoint(self.filename)
+                self.assertTrue(checkpoint.resume())
+            self.assertEquals(
+                checkpoint.commit_facts('http://example.org/commit1'), None)
+            self.assertEquals(checkpoint.project_commits(
+                    commits.Project('nens', 'githubinfo', {})), None)
+
+    def test_error_message_as_commit_details(self):
+        with mock.patch('githubinfo.commits.grab_json',
+                        return_value={'message': 'Server Error'}):
+            self.assertRaises(commits.GithubError, commits.Commit,
+                              CommitTest.sample_commit_dict)
+
+    def test_finish(self):
+        checkpoint = commits.Checkpoint(self.filename)
+        checkpoint.save()
+        checkpoint.finish()
+        self.assertFalse(os.path.exists(self.filename))
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        recorder = archive.Recorder(self.tempdir,
+                                    {'since': '1972-12-18T00:00:00'})
+        recorder.store('http://example.org/commits', {'sha': 'master'},
+                       [{'sha': 'a'}], 'http://example.org/commits?page=2')
+        recorder.store('http://example.org/commits?page=2', {'sha': 'master'},
+                       [{'sha': 'b'}], None)
+        recorder.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_metadata(self):
+        replayer = archive.Replayer(self.tempdir)
+        self.assertEquals(replayer.metadata['since'], '1972-12-18T00:00:00')
+
+    def test_lookup(self):
+        replayer = archive.Replayer(self.tempdir)
+        self.assertEquals(
+            replayer.lookup('http://example.org/commits', {'sha': 'master'}),
+            ([{'sha': 'a'}], 'http://example.org/commits?page=2'))
+
+    def test_lookup_miss(self):
+        replayer = archive.Replayer(self.tempdir)
+        self.assertRaises(archive.ArchiveMissError,
+                          replayer.lookup,
+                          'http://example.org/commits', {'sha': 'other'})
+
+    @mock.patch('requests.get')
+    def test_replayed_grab_json(self, patched_get):
+        replayer = archive.Replayer(self.tempdir)
+        with mock.patch('githubinfo.commits.RESPONSE_STORES', [replayer]):
+            for i in range(2):
+                # Twice, to make sure the archive isn't modified.
+                self.assertEquals(
+                    commits.grab_json('http://example.org/commits',
+                                      params={'sha': 'master'}),
+                    [{'sha': 'a'}, {'sha': 'b'}])
+        self.assertFalse(patched_get.called)
+
+    def test_record_with_resume(self):
+        with mock.patch('sys.argv', ['testcommitinfo', '--resume',
+                                     '--record', self.tempdir]):
+            with mock.patch('sys.stderr'):
+                self.assertRaises(SystemExit, commits.parse_commandline)
+
+    @mock.patch('requests.get')
+    def test_recorded_grab_json(self, patched_get):
+        patched_get.return_value.status_code = 200
+        patched_get.return_value.json.return_value = {'rate': {}}
+        patched_get.return_value.links = {}
+        recorder = archive.Recorder(self.tempdir, {'since': 'whatever'})
+        with mock.patch('githubinfo.commits.RESPONSE_STORES', [recorder]):
+            commits.grab_json('http://example.org/rate_limit')
+        recorder.close()
+        replayer = archive.Replayer(self.tempdir)
+        self.assertEquals(
+            replayer.lookup('http://example.org/rate_limit', None),
+            ({'rate': {}}, None))
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = cache.ResponseCache(self.tempdir)
+        self.commit_url = ('https://api.github.com/repos/nens/githubinfo/'
+                           'commits/' + 40 * 'a')
+        self.branches_url = commits.BRANCHES_URL.format(owner='nens',
+                                                        project='githubinfo')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_time_to_live(self):
+        self.assertEquals(cache.time_to_live(self.commit_url), cache.FOREVER)
+        self.assertEquals(cache.time_to_live(self.branches_url), 300)
+
+    def test_lookup_miss(self):
+        self.assertEquals(self.cache.lookup(self.commit_url, None), None)
+
+    def test_lookup(self):
+        self.cache.store(self.commit_url, None, {'files': []}, None)
+        self.assertEquals(self.cache.lookup(self.commit_url, None),
+                          ({'files': []}, None))
+
+    def test_lookup_with_params(self):
+        self.cache.store(self.branches_url, {'page': 2}, [], None)
+        self.assertEquals(self.cache.lookup(self.branches_url, None), None)
+
+    def test_expired(self):
+        self.cache.store(self.branches_url, None, [], None)
+        self.cache.store(self.commit_url, None, {'files': []}, None)
+        with mock.patch('time.time', return_value=time.time() + 3600):
+            self.assertEquals(self.cache.lookup(self.branches_url, None), None)
+            self.assertTrue(self.cache.lookup(self.commit_url, None))
+
+    def test_evict_over_budget(self):
+        self.cache.max_size = 1
+        self.cache.store(self.branches_url, None, [], None)
+        self.assertEquals(self.cache.entries(), [])
+
+    def test_evict_least_recently_used(self):
+        self.cache.store(self.branches_url, None, [], None)
+        self.cache.store(self.commit_url, None, {'files': []}, None)
+        old = time.time() - 100
+        os.utime(self.cache.filename(self.branches_url, None), (old, old))
+        self.cache.max_size = self.cache.size - 1
+        self.cache.evict()
+        self.assertEquals(self.cache.lookup(self.branches_url, None), None)
+        self.assertTrue(self.cache.lookup(self.commit_url, None))
+
+    def test_concurrent_stores(self):
+        errors = []
+
+        def store():
+            try:
+                for i in range(20):
+                    self.cache.store(self.commit_url, None, {'files': []},
+                                     None)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=store) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(errors, [])
+        self.assertEquals(self.cache.lookup(self.commit_url, None),
+                          ({'files': []}, None))
+
+    @mock.patch('requests.get')
+    def test_recorder_in_front_of_cache(self, patched_get):
+        self.cache.store(self.commit_url, None, {'files': []}, None)
+        recorder = mock.Mock()
+        recorder.lookup.return_value = None
+        with mock.patch('githubinfo.commits.RESPONSE_STORES',
+                        [recorder, self.cache]):
+            commits.grab_json(self.commit_url)
+        self.assertFalse(patched_get.called)
+        self.assertTrue(recorder.store.called)
+
+    @mock.patch('requests.get')
+    def test_rate_limit_error_isnt_cached(self, patched_get):
+        patched_get.return_value.status_code = 403
+        patched_get.return_value.json.return_value = {
+            'message': 'API rate limit exceeded'}
+        with mock.patch('githubinfo.commits.RESPONSE_STORES', [self.cache]):
+            self.assertRaises(commits.GithubError,
+                              commits.grab_json, self.commit_url)
+        self.assertEquals(self.cache.lookup(self.commit_url, None), None)
+
+    @mock.patch('requests.get')
+    def test_not_found_isnt_cached(self, patched_get):
+        patched_get.return_value.status_code = 404
+        patched_get.return_value.json.return_value = {'message': 'Not Found'}
+        patched_get.return_value.links = {}
+        with mock.patch('githubinfo.commits.RESPONSE_STORES', [self.cache]):
+            self.assertEquals(commits.grab_json(self.commit_url),
+                              {'message': 'Not Found'})
+        self.assertEquals(self.cache.lookup(self.commit_url, None), None)
+
+
+SAMPLE_PUSH = {
+    'repository': {'name': 'githubinfo',
+                   'owner': {'name': 'nens', 'login': 'nens'}},
+    'commits': [
+        {'id': 'a' * 40,
+         'distinct': True,
+         'committer': {'name': 'reinout'},
+         'added': ['githubinfo/tests.py'],
+         'modified': ['githubinfo/commits.py'],
+         'removed': []},
+        {'id': 'b' * 40,
+         'distinct': True,
+         'committer': {'name': 'reinout'},
+         'added': [],
+         'modified': ['setup.py'],
+         'removed': []},
+        {'id': 'c' * 40,
+         'distinct': False,  # Already pushed to another branch.
+         'committer': {'name': 'reinout'},
+         'added': ['githubinfo/tests.py'],
+         'modified': [],
+         'removed': []},
+        ]}
+
+
+class WebhookTest(unittest.TestCase):
+
+    def setUp(self):
+        self.statistics = webhook.PushStatistics()
+
+    @mock.patch('githubinfo.commits.grab_json')
+    def test_push_commit(self, patched_grab_json):
+        commit = webhook.push_commit('nens', 'githubinfo',
+                                     SAMPLE_PUSH['commits'][0])
+        self.assertEquals(commit.num_testfiles_changed, 1)
+        self.assertEquals(commit.user, 'reinout')
+        self.assertFalse(patched_grab_json.called)
+
+    @mock.patch('githubinfo.commits.grab_json', new=mock_commit_grabber2)
+    def test_push_commit_with_doctest(self):
+        # A possible doctest needs the API for the patch.
+        commit_info = {'id': 'd' * 40,
+                       'committer': {'name': 'reinout'},
+                       'modified': ['myproject/README.txt']}
+        commit = webhook.push_commit('nens', 'githubinfo', commit_info)
+        self.assertTrue(commit.is_testcommit)
+
+    def test_handle_push(self):
+        self.assertEquals(self.statistics.handle_push(SAMPLE_PUSH), 2)
+        project = self.statistics.projects[('nens', 'githubinfo')]
+        self.assertEquals(project.num_commits, 2)
+        self.assertEquals(project.num_testcommits, 1)
+        self.assertEquals(self.statistics.users['reinout'].num_commits, 2)
+
+    def test_extra_project(self):
+        self.statistics.extra_projects = set([('zestsoftware',
+                                               'zest.releaser')])
+        payload = copy.deepcopy(SAMPLE_PUSH)
+        payload['repository']['name'] = 'zest.releaser'
+        payload['repository']['owner']['login'] = 'zestsoftware'
+        self.assertEquals(self.statistics.handle_push(payload), 2)
+        # Unknown user, so not counted.
+        self.assertFalse(self.statistics.users)
+
+    def test_valid_signature(self):
+        signature = ('sha256=' + hmac.new(b'secret', b'{}',
+                                          hashlib.sha256).hexdigest())
+        self.assertTrue(webhook.valid_signature('secret', b'{}', signature))
+        self.assertFalse(webhook.valid_signature('secret', b'{}', None))
+
+    def test_server(self):
+        server = webhook.make_server('127.0.0.1', 0, self.statistics)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:{}/'.format(server.server_port)
+            response = requests.post(url,
+                                     data=json.dumps(SAMPLE_PUSH),
+                                     headers={'X-GitHub-Event': 'push'})
+            self.assertEquals(response.json(), {'commits': 2})
+            response = requests.post(url, data='{}',
+                                     headers={'X-GitHub-Event': 'ping'})
+            self.assertEquals(response.status_code, 200)
+            result = requests.get(url).json()
+            self.assertEquals(result['projects'][0]['num_testcommits'], 1)
+            self.assertEquals(result['users'][0]['name'], 'reinout')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_server_errors(self):
+        server = webhook.make_server('127.0.0.1', 0, self.statistics)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:{}/'.format(server.server_port)
+            headers = {'X-GitHub-Event': 'push'}
+            for data in ['not json', '{}', '[]']:
+                response = requests.post(url, data=data, headers=headers)
+                self.assertEquals(response.status_code, 400)
+            with mock.patch('githubinfo.webhook.push_commit',
+                            side_effect=commits.GithubError("Rate limit")):
+                response = requests.post(url, data=json.dumps(SAMPLE_PUSH),
+                                         headers=headers)
+            self.assertEquals(response.status_code, 502)
+            self.assertEquals(requests.get(url).json()['projects'], [])
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+
+def mock_response(json_content, links=None):
+    response = mock.Mock()
+    response.json.return_value = json_content
+    response.links = links or {}
+    return response
+
+
+class PlanTest(unittest.TestCase):
+
+    def test_num_pages1(self):
+        self.assertEquals(commits.num_pages(mock_response([])), 1)
+
+    def test_num_pages2(self):
+        response = mock_response([], {'last': {
+                    'url': 'https://api.github.com/x?since=now&page=7'}})
+        self.assertEquals(commits.num_pages(response), 7)
+
+    def test_estimated_count(self):
+        response = mock_response(30 * [{}], {'last': {
+                    'url': 'https://api.github.com/x?page=3'}})
+        self.assertEquals(commits.estimated_count(response), 75)
+
+    def test_estimated_count_error(self):
+        self.assertEquals(commits.estimated_count(
+                mock_response({'message': 'Not Found'})), 0)
+
+    def test_plan_project(self):
+        def mock_api_get(url, params=None):
+            if url.endswith('/branches'):
+                return mock_response(3 * [{}])
+            return mock_response(30 * [{}], {'last': {
+                        'url': 'https://api.github.com/x?page=2'}})
+
+        with mock.patch('githubinfo.commits.api_get', mock_api_get):
+            result = commits.plan_project('nens', 'githubinfo')
+        self.assertEquals(result['commits'], 45)
+        # 1 branches page + 2 commit pages + 2 other branches + 45 details.
+        self.assertEquals(result['requests'], 50)
+
+    def test_plan(self):
+        settings = nens_settings()
+        project_plan = {'project': 'nens/githubinfo',
+                        'branches': 1,
+                        'commits': 10,
+                        'requests': 12}
+        rate = {'limit': 60, 'remaining': 10, 'reset': 0}
+        with mock.patch('githubinfo.commits.SETTINGS', settings):
+            with mock.patch('githubinfo.commits.api_get',
+                            return_value=mock_response(
+                                [{'name': 'githubinfo'}])):
+                with mock.patch('githubinfo.commits.plan_project',
+                                return_value=project_plan):
+                    with mock.patch('githubinfo.commits.grab_json',
+                                    return_value={'resources': {
+                                        'core': rate}}):
+                        result = commits.plan()
+        self.assertEquals(result['requests'], 13)
+        self.assertEquals(result['plan_requests'], 3)
+        self.assertEquals(result['rate_limit_windows'], 2)
+        with mock.patch('sys.stdout'):
+            commits.print_plan(result)
+
+    def test_plan_with_workers(self):
+        rate = {'limit': 60, 'remaining': 10, 'reset': 0}
+        with mock.patch('githubinfo.commits.SETTINGS', nens_settings()):
+            with mock.patch('githubinfo.commits.api_get',
+                            return_value=mock_response([])):
+                with mock.patch('githubinfo.commits.grab_json',
+                                return_value={'resources': {'core': rate}}):
+                    with mock.patch('githubinfo.commits.time') as patched:
+                        patched.time.side_effect = [0, 10]
+                        result = commits.plan(workers=4)
+        # One request of 10 seconds, spread over 4 workers.
+        self.assertEquals(result['seconds'], 2.5)
+
+    def test_plan_with_replay(self):
+        with mock.patch('sys.argv', ['testcommitinfo', '--plan',
+                                     '--replay', 'archive']):
+            with mock.patch('sys.stderr'):
+                self.assertRaises(SystemExit, commits.parse_commandline)
+
+
+class TestFileClassifierTest(unittest.TestCase):
+
+    def test_defaults(self):
+        classifier = commits.TestFileClassifier({})
+        self.assertEquals(
+            classifier.classify([
+                    {'filename': 'myproject/tests.py'},
+                    {'filename': 'myproject/testsettings.py'},
+                    {'filename': 'myproject/README.rst', 'patch': ''},
+                    {'filename': 'myproject/usage.txt', 'patch': '>>> 1'},
+                    {'filename': 'myproject/views.py'}]),
+            [True, False, False, True, False])
+
+    def test_path_verdict_is_memoized(self):
+        classifier = commits.TestFileClassifier({})
+        self.assertEquals(classifier.path_verdict('README.rst'), None)
+        self.assertTrue('README.rst' in classifier.verdicts)
+
+    def test_custom_rules(self):
+        classifier = commits.TestFileClassifier({
+                'include': ['spec/*', '*_spec.js'],
+                'exclude': ['vendor/*'],
+                'include_regexes': [r'^features/.+\.feature$'],
+                'doctest_extensions': []})
+        self.assertEquals(
+            [classifier.path_verdict(path) for path in [
+                    'spec/models.rb',
+                    'app/widget_spec.js',
+                    'vendor/spec/lib.rb',
+                    'features/login.feature',
+                    'myproject/tests.py',
+                    'README.rst']],
+            [True, True, False, True, False, False])
+
+    def test_regexes_are_independent(self):
+        classifier = commits.TestFileClassifier({
+                'include': [],
+                'exclude_regexes': ['(?i)vendor', '(?P<include>legacy)'],
+                'include_regexes': [r'(\w+)/\1_test']})
+        self.assertEquals(
+            [classifier.path_verdict(path) for path in [
+                    'foo/foo_test.py',
+                    'foo/bar_test.py',
+                    'Vendor/foo/foo_test.py',
+                    'legacy/foo/foo_test.py']],
+            [True, False, False, False])
+
+    def test_no_rules(self):
+        classifier = commits.TestFileClassifier({
+                'include': [], 'exclude': [], 'doctest_extensions': []})
+        self.assertFalse(classifier.path_verdict('tests.py'))
+
+    def test_classifier_from_settings(self):
+        settings = copy.deepcopy(commits.SETTINGS)
+        settings['testfile_rules'] = {'include': ['*_spec.js']}
+        with mock.patch('githubinfo.commits.SETTINGS', settings):
+            self.assertTrue(commits.is_testfile({'filename': 'a_spec.js'}))
+            self.assertFalse(commits.is_testfile({'filename': 'tests.py'}))
+            classifier = commits.testfile_classifier()
+            self.assertTrue(classifier is commits.testfile_classifier())
+        self.assertTrue(commits.is_testfile({'filename': 'tests.py'}))
+
+
+def make_commit(user, date, num_testfiles_changed=0):
+    return commits.Commit.from_facts(
+        {'url': 'http://example.org/dummy',
+         'user': user,
+         'date': date,
+         'num_testfiles_changed': num_testfiles_changed})
+
+
+class StatisticsCubeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cube = cube.StatisticsCube()
+        self.cube.add_commit('nens/githubinfo',
+                             make_commit('reinout', '2013-04-01', 2))
+        self.cube.add_commit('nens/githubinfo',
+                             make_commit('reinout', '2013-04-01'))
+        self.cube.add_commit('nens/githubinfo',
+                             make_commit('maurits', '2013-04-02', 1))
+        self.cube.add_commit('nens/lizard-ui',
+                             make_commit('reinout', '2013-04-02'))
+
+    def test_cells(self):
+        self.assertEquals(len(self.cube), 3)
+
+    def test_totals(self):
+        totals = self.cube.totals('user')
+        self.assertEquals(totals['reinout'], {'num_commits': 3,
+                                              'num_testcommits': 1,
+                                              'testfiles_changed': 2})
+        self.assertEquals(totals['maurits']['num_testcommits'], 1)
+
+    def test_pivot(self):
+        pivot = self.cube.pivot('project', 'user')
+        self.assertEquals(
+            pivot['nens/githubinfo']['reinout']['num_commits'], 2)
+        self.assertFalse('maurits' in pivot['nens/lizard-ui'])
+
+    def test_trend(self):
+        trend = self.cube.trend()
+        self.assertEquals([day['day'] for day in trend],
+                          ['2013-04-01', '2013-04-02'])
+        self.assertEquals(trend[1]['num_commits'], 2)
+
+    def test_filled_by_project(self):
+        statistics_cube = cube.StatisticsCube()
+        project = commits.Project('nens', 'githubinfo', defaultdict(
+                commits.User), statistics_cube=statistics_cube)
+        project.add_commits([make_commit('reinout', '2013-04-01', 1)])
+        self.assertEquals(
+            statistics_cube.totals('project')['nens/githubinfo'][
+                'num_testcommits'], 1)
+
+    def test_derive_totals(self):
+        users = defaultdict(commits.User)
+        githubinfo = commits.Project('nens', 'githubinfo', users,
+                                     statistics_cube=self.cube)
+        lizard_ui = commits.Project('nens', 'lizard-ui', users,
+                                    statistics_cube=self.cube)
+        githubinfo.add_commits([make_commit('reinout', '2013-04-03', 1)])
+        commits.derive_totals([githubinfo, lizard_ui], users.values(),
+                              self.cube)
+        self.assertEquals((githubinfo.num_commits,
+                           githubinfo.num_testcommits,
+                           githubinfo.testfiles_changed), (4, 3, 4))
+        self.assertEquals(lizard_ui.num_commits, 1)
+        self.assertEquals(users['reinout'].name, 'reinout')
+        self.assertEquals(users['reinout'].num_commits, 4)
+
+
+class FakeProject(object):
+    """Project that 'loads' a number of commits without API calls."""
+
+    def __init__(self, key, num_commits):
+        self.key = key
+        self.name = key
+        self.num_commits = num_commits
+        self.loaded = None
+
+    def load_listing(self):
+        self.commits = [{'sha': '{}-{}'.format(self.key, i)}
+                        for i in range(self.num_commits)]
+
+    def load_commit_details(self, commit_dicts):
+        return [commit['sha'] for commit in commit_dicts]
+
+    def done(self, loaded_commits):
+        self.loaded = loaded_commits
+
+
+class SchedulingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.small = FakeProject('small', 3)
+        self.huge = FakeProject('huge', 100)
+        self.timings = scheduling.Timings()
+        self.timings.timings = {'small': {'requests': 4, 'seconds': 1},
+                                'huge': {'requests': 102, 'seconds': 50}}
+
+    def test_count_request(self):
+        before = scheduling.num_requests()
+        scheduling.count_request()
+        self.assertEquals(scheduling.num_requests(), before + 1)
+
+    def test_expected_cost(self):
+        self.assertEquals(self.timings.expected_cost(self.huge), 50)
+        self.assertEquals(self.timings.expected_cost(FakeProject('new', 1)),
+                          scheduling.UNKNOWN_COST)
+
+    def test_longest_first(self):
+        order = []
+        scheduler = scheduling.ProjectScheduler(1, self.timings)
+        original = scheduler.list_project
+
+        def recording_list_project(project):
+            order.append(project.key)
+            original(project)
+
+        scheduler.list_project = recording_list_project
+        scheduler.run([self.small, self.huge])
+        self.assertEquals(order, ['huge', 'small'])
+
+    def test_run_parallel(self):
+        scheduler = scheduling.ProjectScheduler(4, self.timings)
+        result = scheduler.run([self.small, self.huge])
+        # Chunks are put back together in the original order.
+        self.assertEquals(result['huge'],
+                          ['huge-{}'.format(i) for i in range(100)])
+        self.assertEquals(self.huge.loaded, result['huge'])
+        self.assertEquals(len(result['small']), 3)
+        # Without real requests, the previous numbers are kept.
+        self.assertEquals(self.timings.timings['small']['requests'], 4)
+
+    def test_timings_of_real_requests(self):
+        def load_listing():
+            scheduling.count_request(2)
+            FakeProject.load_listing(self.small)
+
+        self.small.load_listing = load_listing
+        scheduling.ProjectScheduler(1, self.timings).run([self.small])
+        self.assertEquals(self.timings.timings['small']['requests'], 2)
+
+    def test_timings_of_unfinished_project(self):
+        self.timings.reset(self.small)
+        self.timings.add(self.small, 1, 0.1)
+        self.assertEquals(self.timings.timings['small']['requests'], 4)
+
+    def test_run_without_workers(self):
+        scheduler = scheduling.ProjectScheduler(0, self.timings)
+        result = scheduler.run([self.small])
+        self.assertEquals(len(result['small']), 3)
+
+    def test_workers_must_be_positive(self):
+        with mock.patch('sys.argv', ['testcommitinfo', '--workers', '0']):
+            with mock.patch('sys.stderr'):
+                self.assertRaises(SystemExit, commits.parse_commandline)
+
+    def test_error(self):
+        self.huge.load_listing = mock.Mock(side_effect=ValueError)
+        scheduler = scheduling.ProjectScheduler(2, self.timings)
+        self.assertRaises(ValueError, scheduler.run, [self.small, self.huge])
+
+    def test_error_is_logged_briefly(self):
+        self.huge.load_commit_details = mock.Mock(
+            side_effect=ValueError("Rate limit"))
+        scheduler = scheduling.ProjectScheduler(1, self.timings)
+        with mock.patch('githubinfo.scheduling.logger') as patched:
+            self.assertRaises(ValueError, scheduler.run, [self.huge])
+        self.assertFalse(patched.exception.called)
+        message = patched.warn.call_args[0][0] % patched.warn.call_args[0][1:]
+        self.assertEquals(message, "Error in load_chunk of huge: Rate limit")
+
+    def test_timings_roundtrip(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, 'timings.json')
+            self.timings.filename = filename
+            self.timings.save()
+            self.assertEquals(scheduling.Timings(filename).timings,
+                              self.timings.timings)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_collect_info_with_workers(self):
+        with mocked_github(nens_settings()):
+            projects, users = commits.collect_info(workers=3)
+        self.assertEquals(projects[0].num_testcommits, 1)
+        self.assertEquals(users[0].name, 'reinout')
+
+
+class CommitSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'commits.ndjson')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_sha(self):
+        commit = make_commit('reinout', '2013-04-01T10:00:00Z')
+        commit.url = 'https://api.github.com/repos/nens/x/commits/abc123'
+        self.assertEquals(commit.sha, 'abc123')
+
+    @mock.patch('githubinfo.commits.grab_json', new=mock_commit_grabber2)
+    def test_testfiles(self):
+        commit = commits.Commit(CommitTest.sample_commit_dict)
+        self.assertEquals(commit.testfiles, ['myproject/tests.py'])
+        self.assertEquals(commit.num_testfiles_changed, 1)
+
+    def test_write(self):
+        sink = commits.CommitSink(self.filename)
+        project = commits.Project('nens', 'githubinfo', {})
+        commit = make_commit('reinout', '2013-04-01T10:00:00Z', 1)
+        commit.testfiles = ['tests.py']
+        sink.write(project, commit)
+        # Flushed right away.
+        line = open(self.filename).readline()
+        sink.close()
+        self.assertEquals(json.loads(line),
+                          {'repo': 'nens/githubinfo',
+                           'sha': 'dummy',
+                           'committer': 'reinout',
+                           'date': '2013-04-01T10:00:00Z',
+                           'num_testfiles': 1,
+                           'testfiles': ['tests.py']})
+
+    def test_collect_info(self):
+        sink = commits.CommitSink(self.filename)
+        with mocked_github(nens_settings()):
+            commits.collect_info(commit_sink=sink)
+        sink.close()
+        lines = open(self.filename).readlines()
+        self.assertEquals(len(lines), 1)
+        self.assertEquals(json.loads(lines[0])['testfiles'],
+                          ['myproject/tests.py'])
+
+
+class ProgressTest(unittest.TestCase):
+
+    def setUp(self):
+        self.progress = progress.Progress()
+        self.progress.start(4)
+
+    def test_disabled(self):
+        # Not enabled, so nothing is shown, but it still counts.
+        self.progress.detail_fetched()
+        self.assertEquals(self.progress.details_fetched, 1)
+
+    def test_as_dict(self):
+        self.progress.response(rate_limit_remaining='4321')
+        self.progress.response(cached=True)
+        self.progress.listed(10)
+        self.progress.project_done()
+        info = self.progress.as_dict()
+        self.assertEquals(info['projects_done'], 1)
+        self.assertEquals(info['commits_listed'], 10)
+        self.assertEquals(info['cache_hit_rate'], 0.5)
+        self.assertEquals(info['rate_limit_remaining'], 4321)
+        self.assertTrue(info['eta'] is not None)
+
+    def test_format_duration(self):
+        self.assertEquals(progress.format_duration(None), '?')
+        self.assertEquals(progress.format_duration(75), '1m15s')
+        self.assertEquals(progress.format_duration(7260), '2h01m')
+
+    def test_tty(self):
+        stream = mock.Mock()
+        stream.isatty.return_value = True
+        self.progress.enable(stream)
+        self.progress.project_done()
+        self.progress.finish()
+        written = ''.join(call[0][0] for call in stream.write.call_args_list)
+        self.assertTrue('\r1/4 projects' in written)
+        self.assertTrue(written.endswith('\n'))
+
+    def test_log_record(self):
+        stream = mock.Mock()
+        stream.isatty.return_value = False
+        self.progress.enable(stream)
+        with mock.patch('githubinfo.progress.logger') as patched_logger:
+            self.progress.finish()
+            self.assertEquals(
+                patched_logger.info.call_args[1]['extra']['progress'][
+                    'projects'], 4)
+        self.assertFalse(stream.write.called)
+
+
+class SamplingTest(unittest.TestCase):
+
+    def test_exact_estimate(self):
+        estimate = sampling.Estimate()
+        estimate.add_stratum(3, [1, 0, 1])
+        self.assertTrue(estimate.exact)
+        self.assertEquals(estimate.value, 2)
+        self.assertEquals(estimate.margin, 0)
+
+    def test_estimate(self):
+        estimate = sampling.Estimate()
+        estimate.add_stratum(100, [1, 0, 1, 0])
+        estimate.add_stratum(10, [1, 1, 1, 1, 1, 1, 1, 1, 1, 1])
+        self.assertFalse(estimate.exact)
+        self.assertEquals(estimate.value, 60)
+        self.assertEquals(estimate.margin, 56)
+
+    def test_estimate_without_sample(self):
+        estimate = sampling.Estimate()
+        estimate.add_stratum(10, [])
+        self.assertEquals(estimate.value, 5)
+        self.assertTrue(estimate.margin >= 5)
+
+    def test_sample_order(self):
+        strata = {'big': list(range(20)), 'small': ['a']}
+        order = sampling.sample_order(strata, random.Random(42))
+        self.assertEquals(len(order), 21)
+        # Every stratum gets its first sample before the rest.
+        self.assertEquals(set(stratum for (stratum, item) in order[:2]),
+                          set(['big', 'small']))
+
+    def test_budget(self):
+        self.assertFalse(sampling.Budget(lambda: 10).exhausted())
+        self.assertTrue(
+            sampling.Budget(lambda: 10, max_requests=10).exhausted())
+        self.assertTrue(sampling.Budget(lambda: 0, deadline=0).exhausted())
+
+    def collect(self, budget, statistics_cube=None):
+        with mocked_github(nens_settings()):
+            return commits.collect_info(statistics_cube=statistics_cube,
+                                        budget=budget)
+
+    def write_json(self, budget):
+        statistics_cube = cube.StatisticsCube()
+        projects, users = self.collect(budget, statistics_cube)
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, 'output.json')
+            commits.write_json(filename, projects, users, statistics_cube)
+            return json.loads(open(filename).read())
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_breakdowns_within_budget(self):
+        output = self.write_json(sampling.Budget(lambda: 0))
+        self.assertEquals(
+            output['users_per_project']['nens/githubinfo']['reinout'][
+                'num_testcommits'], 1)
+        self.assertEquals(len(output['days']), 1)
+
+    def test_no_breakdowns_out_of_budget(self):
+        output = self.write_json(sampling.Budget(lambda: 0, max_requests=0))
+        self.assertFalse('users_per_project' in output)
+        self.assertFalse('days' in output)
+
+    def test_collect_info_within_budget(self):
+        projects, users = self.collect(sampling.Budget(lambda: 0))
+        self.assertEquals(projects[0].num_testcommits, 1)
+        self.assertFalse(projects[0].is_estimate)
+        self.assertEquals(users[0].name, 'reinout')
+
+    def test_collect_info_out_of_budget(self):
+        projects, users = self.collect(
+            sampling.Budget(lambda: 0, max_requests=0))
+        # The commit is still counted, its test-ness is estimated.
+        self.assertEquals(projects[0].num_commits, 1)
+        self.assertTrue(projects[0].is_estimate)
+        self.assertTrue(users[0].as_dict()['estimated'])
+        with mock.patch('sys.stdout'):
+            commits.print_report(projects, users)
+
+    def test_listed_projects_are_done(self):
+        self.collect(sampling.Budget(lambda: 0, max_requests=0))
+        self.assertEquals(commits.PROGRESS.projects_done, 1)
+
+
+class TimeSliceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = copy.deepcopy(commits.SETTINGS)
+        self.settings['since'] = '2013-01-01T00:00:00.123456'
+        self.settings['days'] = 90
+
+    def test_one_slice(self):
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            self.assertEquals(commits.time_slices(1),
+                              [{'since': '2013-01-01T00:00:00.123456'}])
+
+    def test_slices(self):
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            slices = commits.time_slices(3)
+        self.assertEquals(slices, [
+                {'since': '2013-03-02T00:00:00'},
+                {'since': '2013-01-31T00:00:00',
+                 'until': '2013-03-02T00:00:00'},
+                {'since': '2013-01-01T00:00:00.123456',
+                 'until': '2013-01-31T00:00:00'}])
+
+    def test_newest_slice_until(self):
+        self.settings['until'] = '2013-04-01T00:00:00.123456'
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            slices = commits.time_slices(3)
+        self.assertEquals(slices[0], {'since': '2013-03-02T00:00:00',
+                                      'until': '2013-04-01T00:00:00.123456'})
+
+    def test_sliced_project_commits(self):
+        # Every slice returns the commit on the border plus its own one.
+        def mock_grab_json_page(url, params):
+            return ([{'sha': params['since']}, {'sha': 'border'}], None)
+
+        project = commits.Project('nens', 'githubinfo', {}, time_slices=2)
+        project.branch_SHAs = ['master']
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            with mock.patch('githubinfo.commits.grab_json_page',
+                            mock_grab_json_page):
+                result = project.load_project_commits()
+        self.assertEquals([commit['sha'] for commit in result],
+                          ['2013-02-15T00:00:00', 'border',
+                           '2013-01-01T00:00:00.123456'])
+
+    def test_sliced_requests_are_counted(self):
+        def mock_grab_json_page(url, params):
+            scheduling.count_request()
+            return ([], None)
+
+        project = commits.Project('nens', 'githubinfo', {}, time_slices=4)
+        project.branch_SHAs = ['master']
+        requests_before = scheduling.num_requests()
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            with mock.patch('githubinfo.commits.grab_json_page',
+                            mock_grab_json_page):
+                project.load_project_commits()
+        self.assertEquals(scheduling.num_requests() - requests_before, 4)
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.settings = copy.deepcopy(commits.SETTINGS)
+        self.settings.update({'since': '2013-01-01T00:00:00.123456',
+                              'days': 90,
+                              'organizations': ['nens', 'ddsc'],
+                              'extra_projects': [('reinout', 'buildout')]})
+        self.team1 = {'name': 'team1',
+                      'days': 90,
+                      'organizations': ['nens'],
+                      'extra_projects': [('reinout', 'buildout')]}
+        self.team2 = {'name': 'team2',
+                      'days': 30,
+                      'organizations': ['ddsc', 'nens'],
+                      'extra_projects': [['reinout', 'buildout']]}
+        self.requested = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def mock_grab_json(self, url, params=None):
+        self.requested.append(url)
+        if url == commits.ORG_REPOS_URL.format(organization='nens'):
+            return [{'name': 'githubinfo'}]
+        if url == commits.ORG_REPOS_URL.format(organization='ddsc'):
+            return [{'name': 'ddsc-core'}]
+        if url.endswith('/branches'):
+            return [{'commit': {'sha': 'master'}}]
+        if url.endswith('/commits'):
+            project = url.split('/')[-2]
+            return [
+                {'sha': project + '-old',
+                 'commit': {'committer': {'name': 'reinout',
+                                          'date': '2013-02-01T12:00:00Z'}},
+                 'url': 'http://example.org/{}-old'.format(project)},
+                {'sha': project + '-new',
+                 'commit': {'committer': {'name': project + '-dev',
+                                          'date': '2013-03-30T12:00:00Z'}},
+                 'url': 'http://example.org/{}-new'.format(project)}]
+        return {'files': [{'filename': 'myproject/tests.py'}]}
+
+    def mock_grab_json_page(self, url, params=None):
+        return self.mock_grab_json(url, params), None
+
+    def test_load_profile(self):
+        filename = os.path.join(self.tempdir, 'team1.json')
+        open(filename, 'w').write(json.dumps({'days': 14}))
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            profile = commits.load_profile(filename)
+        self.assertEquals(profile['name'], 'team1')
+        self.assertEquals(profile['days'], 14)
+        self.assertEquals(profile['organizations'], ['nens', 'ddsc'])
+
+    def test_union_settings(self):
+        self.assertEquals(
+            commits.union_settings([self.team1, self.team2]),
+            {'days': 90,
+             'organizations': ['nens', 'ddsc'],
+             'extra_projects': [('reinout', 'buildout')]})
+
+    def test_profile_since(self):
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            self.assertEquals(commits.profile_since(self.team1),
+                              '2013-01-01T00:00:00')
+            self.assertEquals(commits.profile_since(self.team2),
+                              '2013-03-02T00:00:00')
+
+    def test_collect_batch(self):
+        with mock.patch('githubinfo.commits.SETTINGS', self.settings):
+            with mock.patch('githubinfo.commits.grab_json',
+                            self.mock_grab_json):
+                with mock.patch('githubinfo.commits.grab_json_page',
+                                self.mock_grab_json_page):
+                    results = commits.collect_batch([self.team1, self.team2])
+        # Every project and commit is fetched only once.
+        self.assertEquals(len(self.requested), len(set(self.requested)))
+        self.assertEquals(self.requested.count('http://example.org/'
+                                               'githubinfo-new'), 1)
+
+        profile, projects, users, statistics_cube = results[0]
+        self.assertEquals(profile['name'], 'team1')
+        self.assertEquals(sorted(project.key for project in projects),
+                          ['nens/githubinfo', 'reinout/buildout'])
+        # Only reinout committed to our own projects.
+        buildout = [project for project in projects
+                    if project.key == 'reinout/buildout'][0]
+        self.assertEquals(buildout.num_commits, 1)
+        self.assertEquals(sorted(user.name for user in users),
+                          ['githubinfo-dev', 'reinout'])
+        self.assertEquals(len(statistics_cube.trend()), 2)
+
+        profile, projects, users, statistics_cube = results[1]
+        self.assertEquals(profile['name'], 'team2')
+        # Only the last 30 days.
+        self.assertEquals(sorted(project.key for project in projects),
+                          ['ddsc/ddsc-core', 'nens/githubinfo'])
+        self.assertEquals(sorted(user.name for user in users),
+                          ['ddsc-core-dev', 'githubinfo-dev'])
+        self.assertEquals([day['day'] for day in statistics_cube.trend()],
+                          ['2013-03-30'])
+        with mock.patch('sys.stdout'):
+            commits.print_report(projects, users, profile)
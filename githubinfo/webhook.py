@@ -0,0 +1,177 @@
+"""Receiver for github's ``push`` webhook events.
+
+Instead of polling github, let github tell us about new commits. A push event
+lists the added, modified and removed files of every pushed commit, so we can
+classify them right away. Only for possible doctests we have to ask the API
+for the commit's patch.
+
+The statistics are kept in memory and are available as json with a GET
+request.
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from collections import defaultdict
+import hashlib
+import hmac
+import json
+import logging
+
+try:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+except ImportError:  # Python 2.
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+
+from githubinfo import commits
+
+logger = logging.getLogger(__name__)
+
+
+def push_commit(owner, project, commit_info):
+    """Return Commit for a commit in a push event.
+
+    Only when one of the changed files might be a doctest do we need the
+    API: the push event doesn't include the patch.
+    """
+    user = commit_info['committer']['name']
+    date = commit_info.get('timestamp', '')
+    url = '{}/{}'.format(commits.COMMITS_URL.format(owner=owner,
+                                                    project=project),
+                         commit_info['id'])
+    paths = (commit_info.get('added', []) +
+             commit_info.get('modified', []) +
+             commit_info.get('removed', []))
+    classifier = commits.testfile_classifier()
+    testfiles = []
+    for path in paths:
+        verdict = classifier.path_verdict(path)
+        if verdict:
+            testfiles.append(path)
+        elif verdict is None:
+            logger.debug("Possible doctest %s, asking the API", path)
+            return commits.Commit(
+                {'commit': {'committer': {'name': user, 'date': date}},
+                 'url': url})
+    return commits.Commit.from_facts(
+        {'url': url,
+         'user': user,
+         'date': date,
+         'testfiles': testfiles,
+         'num_testfiles_changed': len(testfiles)})
+
+
+class PushStatistics(object):
+    """Per-user and per-project counters, updated with every push."""
+
+    def __init__(self):
+        self.users = defaultdict(commits.User)
+        self.projects = {}
+        self.extra_projects = set(
+            tuple(extra_project)
+            for extra_project in commits.SETTINGS['extra_projects'])
+
+    def project(self, owner, name):
+        key = (owner, name)
+        if key not in self.projects:
+            self.projects[key] = commits.Project(
+                owner, name, self.users,
+                restrict_to_known_users=(key in self.extra_projects))
+        return self.projects[key]
+
+    def handle_push(self, payload):
+        """Count the payload's commits, return the number of new commits."""
+        repository = payload['repository']
+        owner = (repository['owner'].get('login') or
+                 repository['owner']['name'])
+        project = self.project(owner, repository['name'])
+        pushed_commits = [
+            push_commit(owner, project.name, commit_info)
+            for commit_info in payload.get('commits', [])
+            # Non-distinct commits have been pushed before (to another
+            # branch, for instance).
+            if commit_info.get('distinct', True)]
+        project.add_commits(pushed_commits)
+        return len(pushed_commits)
+
+    def as_dict(self):
+        projects = sorted((project for project in self.projects.values()
+                           if project.is_active),
+                          key=lambda project: project.sort_key)
+        users = sorted(self.users.values(), key=lambda user: user.sort_key)
+        return {'projects': [project.as_dict() for project in projects],
+                'users': [user.as_dict() for user in users]}
+
+
+def valid_signature(secret, body, signature):
+    """Return whether github's X-Hub-Signature-256 header matches."""
+    expected = 'sha256=' + hmac.new(secret.encode('utf-8'), body,
+                                    hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or '')
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """POST push events to us; GET the statistics as json."""
+
+    def send_json(self, status, content):
+        body = json.dumps(content, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.send_json(200, self.server.statistics.as_dict())
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        secret = commits.SETTINGS.get('webhook_secret')
+        if secret and not valid_signature(
+                secret, body, self.headers.get('X-Hub-Signature-256')):
+            logger.warn("Invalid webhook signature, ignoring the event")
+            self.send_json(403, {'error': 'invalid signature'})
+            return
+        event = self.headers.get('X-GitHub-Event')
+        if event != 'push':
+            # 'ping' (when you add the webhook) or something we don't use.
+            self.send_json(200, {'ignored': event})
+            return
+        try:
+            payload = json.loads(body.decode('utf-8'))
+            num_commits = self.server.statistics.handle_push(payload)
+        except commits.GithubError as e:
+            # Nothing of the push is counted: github can redeliver it.
+            logger.warn("API error while counting a push event: %s", e)
+            self.send_json(502, {'error': 'github API error'})
+            return
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warn("Ignoring malformed push event: %r", e)
+            self.send_json(400, {'error': 'malformed push event'})
+            return
+        logger.info("Counted %s commits pushed to %s", num_commits,
+                    payload['repository']['name'])
+        self.send_json(200, {'commits': num_commits})
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def make_server(host='', port=commits.WEBHOOK_PORT, statistics=None):
+    """Return http server that feeds push events into the statistics."""
+    server = HTTPServer((host, port), WebhookHandler)
+    server.statistics = statistics or PushStatistics()
+    return server
+
+
+def serve(host='', port=commits.WEBHOOK_PORT):
+    server = make_server(host, port)
+    logger.info("Listening for github push events on port %s...",
+                server.server_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()